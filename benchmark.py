@@ -0,0 +1,386 @@
+"""
+Offline benchmarks for the extraction pipeline.
+
+Generates a synthetic MediaWiki export of configurable size and measures throughput and peak memory of each
+stage in a fresh process, the memory being what the stage needed on top of its loaded input. Results are written
+as JSON so that runs can be compared, and a golden file of the extracted rows guards against speedups that change
+the output.
+
+    python benchmark.py run --pages 20000 --output before.json --golden golden.json
+    python benchmark.py run --pages 20000 --output after.json --golden golden.json --lazy-sections
+    python benchmark.py compare before.json after.json
+    python benchmark.py differential --pages 20000
+"""
+import argparse
+import bz2
+import csv
+import gzip
+import hashlib
+import json
+import logging
+import multiprocessing
+import pickle
+import queue
+import random
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+from xml.sax.saxutils import escape
+
+import main
+from elements import Page, Row
+from sections import parse_slice, slice_etymologies
+from tokenizer import scan_section
+
+STAGES = ("stream_terms", "parse_wikitext", "clean_wikicode", "write_all")
+# Stages working on the extracted pages, which are handed to them as a pickle written beforehand
+PAGE_STAGES = ("parse_wikitext", "clean_wikicode")
+
+LANGUAGES = (("English", "en"), ("Latin", "la"), ("French", "fr"), ("German", "de"), ("Old English", "ang"),
+             ("Middle English", "enm"), ("Ancient Greek", "grc"), ("Proto-Indo-European", "ine-pro"),
+             ("Proto-Germanic", "gem-pro"), ("Old French", "fro"), ("Spanish", "es"), ("Italian", "it"))
+WORDS = ("amicus", "frater", "pater", "māter", "lupus", "wulf", "hund", "canis", "domus", "aqua", "ignis", "terra",
+         "*ph₂tḗr", "*wĺ̥kʷos", "*bʰréh₂tēr", "brēad", "stān", "λόγος", "φίλος", "-ness", "un-", "-ly")
+SEPARATORS = (" + ", " from ", " < ", ", ", " and ", ". From ", " &lt; ", " ", "\n")
+
+
+class DumpGenerator:
+    """
+    Builds MediaWiki export XML made of pages with etymologies (templates chained by free text, `etyl` patterns,
+    wikilinks), pages without any, huge pages (long translation tables), redirects and non-article namespaces.
+    """
+    def __init__(self, seed: int = 0, etymology_ratio: float = 0.3, huge_ratio: float = 0.005):
+        self.random = random.Random(seed)
+        self.etymology_ratio = etymology_ratio
+        self.huge_ratio = huge_ratio
+
+    def word(self) -> str:
+        return self.random.choice(WORDS)
+
+    def code(self) -> str:
+        return self.random.choice(LANGUAGES)[1]
+
+    def template(self, lang: str) -> str:
+        choices = (
+            "{{{{inh|{lang}|{src}|{word}}}}}", "{{{{bor|{lang}|{src}|{word}|t=gloss}}}}", "{{{{der|{lang}|{src}|{word}}}}}",
+            "{{{{af|{lang}|{word}|{word2}}}}}", "{{{{m|{src}|{word}}}}}", "{{{{cog|{src}|{word}}}}}",
+            "{{{{etyl|{src}|{lang}}}}} ''{word}''", "{{{{etyl|{src}|{lang}}}}} {{{{m|{src}|{word}}}}}",
+            "{{{{root|{lang}|ine-pro|*h₂er-}}}}", "[[{word}]]", "{{{{compound|{lang}|{word}|{word2}}}}}",
+            "{{{{suffix|{lang}|{word}|ness}}}}", "{{{{prefix|{lang}|un|{word}}}}}", "{{{{rfe|{lang}}}}}",
+            "{{{{l|{src}|[[{word}]]}}}}", "{{{{confix|{lang}|a|{word}|b}}}}", "{{{{doublet|{lang}|{word}}}}}",
+        )
+        return self.random.choice(choices).format(lang=lang, src=self.code(), word=self.word(), word2=self.word())
+
+    def etymology(self, lang: str) -> str:
+        parts = [self.random.choice(("From ", "", "Borrowed from ", "Compare "))]
+        for _ in range(self.random.randint(1, 6)):
+            parts.append(self.template(lang))
+            parts.append(self.random.choice(SEPARATORS))
+        extra = self.random.random()
+        if extra < 0.05:
+            parts.append("<!-- comment -->")
+        elif extra < 0.1:
+            parts.append("<ref>{{cite-web|title=x}}</ref>")
+        elif extra < 0.13:
+            parts.append("\n* {{m|en|example}}\n")
+        return "".join(parts)
+
+    def page_text(self, etymology: bool, huge: bool) -> str:
+        blocks = []
+        for name, code in self.random.sample(LANGUAGES, self.random.randint(1, 3)):
+            blocks.append("=={}==".format(name))
+            count = self.random.choice((1, 1, 1, 2, 3)) if etymology else 0
+            for i in range(count):
+                blocks.append("===Etymology{}===".format(" {}".format(i + 1) if count > 1 else ""))
+                blocks.append(self.etymology(code))
+                if count > 1:
+                    blocks.append("====Noun====\n{{head|" + code + "|noun}}\n# A meaning.")
+            blocks.append("===Pronunciation===\n* {{IPA|" + code + "|/ˈwɜːd/}}")
+            blocks.append("===Noun===\n{{head|" + code + "|noun}}\n# A thing.\n#: ''Example.''")
+            if huge:
+                rows = ("* {}: {{{{t|{}|{}}}}}".format(*self.random.choice(LANGUAGES), self.word())
+                        for _ in range(5000))
+                blocks.append("====Translations====\n{{trans-top|thing}}\n" + "\n".join(rows) + "\n{{trans-bottom}}")
+            blocks.append("----")
+        return "\n\n".join(blocks)
+
+    def pages(self, count: int):
+        for i in range(count):
+            r = self.random.random()
+            ns, redirect = "0", False
+            if r < 0.03:
+                ns, text = "1", "Discussion about ===Etymology==="
+            elif r < 0.08:
+                text, redirect = "#REDIRECT [[{}]]".format(self.word()), True
+            else:
+                etymology = self.random.random() < self.etymology_ratio
+                text = self.page_text(etymology, huge=self.random.random() < self.huge_ratio)
+            yield "{}{}".format(self.word(), i), ns, redirect, text
+
+    def write(self, path: Path, count: int) -> None:
+        with bz2.open(path, "wt", encoding="utf-8") as f_out:
+            f_out.write('<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10" xml:lang="en">\n'
+                        '  <siteinfo>\n    <sitename>Wiktionary</sitename>\n  </siteinfo>\n')
+            for i, (title, ns, redirect, text) in enumerate(self.pages(count)):
+                sha1 = hashlib.sha1(text.encode("utf-8")).hexdigest()
+                f_out.write(
+                    "  <page>\n    <title>{}</title>\n    <ns>{}</ns>\n    <id>{}</id>\n{}"
+                    "    <revision>\n      <id>{}</id>\n      <model>wikitext</model>\n      <format>text/x-wiki</format>\n"
+                    '      <text bytes="{}" xml:space="preserve">{}</text>\n      <sha1>{}</sha1>\n'
+                    "    </revision>\n  </page>\n".format(
+                        escape(title), ns, i + 1, '    <redirect title="x" />\n' if redirect else "",
+                        i + 1000, len(text.encode("utf-8")), escape(text), sha1))
+            f_out.write("</mediawiki>\n")
+
+
+def normalize_tags(rows: Sequence[Row]) -> List[list]:
+    """
+    `group_tag`s are random, so they're renumbered in order of appearance to make outputs comparable.
+    """
+    tags = {}
+    normalized = []
+    for row in rows:
+        row = list(row)
+        for i in (8, 9):
+            if row[i] is not None and row[i] != "":
+                row[i] = tags.setdefault(row[i], "tag{}".format(len(tags)))
+        normalized.append(row)
+    return normalized
+
+
+def digest(rows: Sequence[Sequence]) -> str:
+    return hashlib.sha1(json.dumps(rows, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def load_pages(dump_path: Path) -> List[Page]:
+    return list(main.stream_terms(prefilter=main.has_etymology_heading, input_file=dump_path))
+
+
+def write_pages(dump_path: Path, path: Path) -> None:
+    with open(path, "wb") as f_out:
+        pickle.dump(load_pages(dump_path), f_out, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def read_pages(path: Path) -> List[Page]:
+    with open(path, "rb") as f_in:
+        return pickle.load(f_in)
+
+
+def bench_stream_terms(dump_path: Path, pages_path: Optional[Path], options: Dict) -> Dict:
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    pages = 0
+    chars = 0
+    for page in main.stream_terms(prefilter=main.has_etymology_heading, input_file=dump_path):
+        pages += 1
+        chars += len(page.text or "")
+    elapsed = time.perf_counter() - start
+    return {"seconds": elapsed, "items": pages, "items_per_second": pages / elapsed,
+            "bytes_per_second": dump_path.stat().st_size / elapsed, "chars": chars, "baseline_rss_mb": baseline}
+
+
+def bench_parse_wikitext(dump_path: Path, pages_path: Optional[Path], options: Dict) -> Dict:
+    pages = read_pages(pages_path)
+    rows = []
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    for page in pages:
+        rows.extend(normalize_tags([e.to_row() for e in main.parse_wikitext(page, **options)]))
+    elapsed = time.perf_counter() - start
+    chars = sum(len(page.text or "") for page in pages)
+    return {"seconds": elapsed, "items": len(pages), "items_per_second": len(pages) / elapsed,
+            "bytes_per_second": chars / elapsed, "rows": len(rows), "golden": digest(rows),
+            "baseline_rss_mb": baseline}
+
+
+def bench_clean_wikicode(dump_path: Path, pages_path: Optional[Path], options: Dict) -> Dict:
+    sections = [e for page in read_pages(pages_path) for _, e in main.page_sections(page.text, **options)]
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    for section in sections:
+        main.clean_wikicode(section)
+    elapsed = time.perf_counter() - start
+    return {"seconds": elapsed, "items": len(sections), "items_per_second": len(sections) / elapsed,
+            "golden": digest([str(section) for section in sections]), "baseline_rss_mb": baseline}
+
+
+def bench_write_all(dump_path: Path, pages_path: Optional[Path], options: Dict) -> Dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        main.DOWNLOAD_PATH = dump_path
+        main.ETYMOLOGY_PATH = Path(tmp_dir).joinpath("etymology.csv.gz")
+        baseline = peak_rss_mb()
+        start = time.perf_counter()
+        main.write_all(template_report_path=Path(tmp_dir).joinpath("template_report.json"), **options)
+        elapsed = time.perf_counter() - start
+        with gzip.open(main.ETYMOLOGY_PATH, "rt") as f_in:
+            reader = csv.reader(f_in)
+            next(reader)
+            # Page order isn't deterministic across workers, so compare the sorted rows with tags blanked out
+            rows = sorted(row[:8] + [bool(row[8]), bool(row[9]), row[10]] for row in reader)
+    return {"seconds": elapsed, "items": len(rows), "items_per_second": len(rows) / elapsed,
+            "bytes_per_second": dump_path.stat().st_size / elapsed, "rows": len(rows), "golden": digest(rows),
+            "peak_worker_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN), "baseline_rss_mb": baseline}
+
+
+def run_stage(stage: str, dump_path: Path, pages_path: Optional[Path], options: Dict,
+              results: multiprocessing.Queue) -> None:
+    """
+    Runs a stage's benchmark, which records the peak RSS once its input is loaded and prepared (`baseline_rss_mb`),
+    just before it starts timing. The stage's `peak_rss_mb` is how far the peak rose above that.
+    """
+    logging.disable(logging.WARNING)
+    result = globals()["bench_" + stage](dump_path, pages_path, options)
+    result["peak_rss_mb"] = peak_rss_mb() - result["baseline_rss_mb"]
+    results.put(result)
+
+
+def run(dump_path: Path, stages: Sequence[str], options: Dict) -> Dict[str, Dict]:
+    """
+    Runs each stage in a freshly spawned process, so that peak RSS is measured per stage. The pages the stages
+    in `PAGE_STAGES` work on are extracted once, here, rather than in the stage's process.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pages_path = None
+        if any(stage in PAGE_STAGES for stage in stages):
+            pages_path = Path(tmp_dir).joinpath("pages.pickle")
+            write_pages(dump_path, pages_path)
+        for stage in stages:
+            stage_results = context.Queue()
+            process = context.Process(target=run_stage, args=(stage, dump_path, pages_path, options, stage_results))
+            process.start()
+            while stage not in results:
+                try:
+                    results[stage] = stage_results.get(timeout=1)
+                except queue.Empty:
+                    if not process.is_alive():
+                        raise RuntimeError("Benchmark of {} failed".format(stage))
+            process.join()
+            logging.info("{}: {:.2f}s, {:.1f} items/s, peak RSS {:.0f} MB above its input".format(
+                stage, results[stage]["seconds"], results[stage]["items_per_second"], results[stage]["peak_rss_mb"]))
+    return results
+
+
+def differential(dump_path: Path) -> Dict:
+    """
+    Extracts every page with both the mwparserfromhell engine and the template-only tokenizer, returning the
+    titles of pages whose rows differ along with how many sliced sections the tokenizer had to hand back.
+    """
+    result = {"pages": 0, "sections": 0, "fallbacks": 0, "mismatches": []}
+    for page in load_pages(dump_path):
+        result["pages"] += 1
+        expected = normalize_tags([e.to_row() for e in main.parse_wikitext(page)])
+        actual = normalize_tags([e.to_row() for e in main.parse_wikitext(page, fast_templates=True)])
+        if actual != expected:
+            result["mismatches"].append(page.title)
+        for _, slices in slice_etymologies(page.text) or []:
+            for section in slices:
+                result["sections"] += 1
+                if scan_section(section) is None and parse_slice(section) is not None:
+                    result["fallbacks"] += 1
+    return result
+
+
+def check_golden(results: Dict[str, Dict], golden_path: Path) -> bool:
+    """
+    Compares the stages' output digests against `golden_path`, recording them there if it doesn't exist yet.
+    """
+    goldens = {stage: result["golden"] for stage, result in results.items() if "golden" in result}
+    if not golden_path.exists():
+        with open(golden_path, "w") as f_out:
+            json.dump(goldens, f_out, indent=2)
+        logging.info("Recorded golden outputs in {}".format(golden_path))
+        return True
+    with open(golden_path) as f_in:
+        expected = json.load(f_in)
+    ok = True
+    for stage, value in goldens.items():
+        if stage in expected and expected[stage] != value:
+            logging.error("Output of {} differs from the golden output".format(stage))
+            ok = False
+    return ok
+
+
+def compare(before: Dict, after: Dict) -> None:
+    for stage, result in after["results"].items():
+        if stage not in before["results"]:
+            continue
+        old = before["results"][stage]
+        print("{:<16} {:>8.2f}s -> {:>8.2f}s  ({:.2f}x)  peak RSS {:.0f} -> {:.0f} MB".format(
+            stage, old["seconds"], result["seconds"], old["seconds"] / result["seconds"],
+            old["peak_rss_mb"], result["peak_rss_mb"]))
+
+
+def main_cli(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the extraction pipeline.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="Write a synthetic dump.")
+    generate.add_argument("path", type=Path)
+    run_parser = commands.add_parser("run", help="Benchmark the pipeline stages.")
+    run_parser.add_argument("--dump", type=Path, help="Existing dump to use instead of generating one.")
+    run_parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    run_parser.add_argument("--output", type=Path, help="JSON file to write the results to.")
+    run_parser.add_argument("--golden", type=Path, help="Golden output digests to check against (or record).")
+    run_parser.add_argument("--lazy-sections", action="store_true")
+    run_parser.add_argument("--fast-templates", action="store_true")
+    differential_parser = commands.add_parser(
+        "differential", help="Check that the template-only tokenizer extracts the same rows as mwparserfromhell.")
+    differential_parser.add_argument("--dump", type=Path, help="Existing dump to use instead of generating one.")
+    for command in (generate, run_parser, differential_parser):
+        command.add_argument("--pages", type=int, default=5000)
+        command.add_argument("--seed", type=int, default=0)
+        command.add_argument("--etymology-ratio", type=float, default=0.3)
+        command.add_argument("--huge-ratio", type=float, default=0.005)
+    compare_parser = commands.add_parser("compare", help="Compare two result files.")
+    compare_parser.add_argument("before", type=Path)
+    compare_parser.add_argument("after", type=Path)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level="INFO")
+    if args.command == "compare":
+        with open(args.before) as f_before, open(args.after) as f_after:
+            compare(json.load(f_before), json.load(f_after))
+        return 0
+
+    generator = DumpGenerator(args.seed, args.etymology_ratio, args.huge_ratio)
+    if args.command == "generate":
+        generator.write(args.path, args.pages)
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dump_path = args.dump
+        if dump_path is None:
+            dump_path = Path(tmp_dir).joinpath("synthetic.xml.bz2")
+            generator.write(dump_path, args.pages)
+        if args.command == "differential":
+            result = differential(dump_path)
+            for title in result["mismatches"]:
+                logging.error("Tokenizer output differs for {}".format(title))
+            logging.info("Pages: {}, sections: {}, tokenizer fallbacks: {}, mismatches: {}".format(
+                result["pages"], result["sections"], result["fallbacks"], len(result["mismatches"])))
+            return 1 if result["mismatches"] else 0
+        options = {"lazy_sections": args.lazy_sections, "fast_templates": args.fast_templates}
+        results = run(dump_path, args.stages, options)
+    report = {"config": {"dump": str(args.dump) if args.dump else None, "pages": args.pages, "seed": args.seed,
+                         "etymology_ratio": args.etymology_ratio, "huge_ratio": args.huge_ratio,
+                         "options": options, "python": sys.version.split()[0]},
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as f_out:
+            json.dump(report, f_out, indent=2)
+    if args.golden and not check_golden(results, args.golden):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,152 @@
+import ast
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from functools import lru_cache
+from pathlib import Path
+from collections import Counter
+from typing import Iterable, List, Optional, Tuple
+
+from elements import LANG_CODE_PATH, Row
+
+SOURCE_DIR = Path(__file__).resolve().parent
+# Version of the cache's tables, part of the parser version
+CACHE_FORMAT = 2
+# Modules whose code decides the rows extracted from a page
+PARSER_MODULES = ("elements.py", "sections.py", "templates.py", "tokenizer.py")
+# Functions of main.py that turn a page into rows, the rest of it being the pipeline around them
+PARSER_FUNCTIONS = ("parse_wikitext", "page_sections", "clean_wikicode", "combine_template_chains",
+                    "merge_etyl_templates", "get_comma_combos", "get_plus_combos", "get_from_chains", "remove_links",
+                    "inherited")
+
+
+@lru_cache(maxsize=None)
+def parser_version() -> str:
+    """
+    Hash of the code that extracts rows from a page and of the language codes its rows are resolved with (full
+    language names and term ids), stored with the cache so that rows extracted by a different version of either
+    are never reused.
+    """
+    digest = hashlib.sha1(str(CACHE_FORMAT).encode("utf-8"))
+    digest.update(LANG_CODE_PATH.read_bytes())
+    for module in PARSER_MODULES:
+        digest.update(SOURCE_DIR.joinpath(module).read_bytes())
+    main_source = SOURCE_DIR.joinpath("main.py").read_text(encoding="utf-8")
+    functions = {node.name: ast.get_source_segment(main_source, node) for node in ast.parse(main_source).body
+                 if isinstance(node, ast.FunctionDef)}
+    for name in PARSER_FUNCTIONS:
+        digest.update(functions[name].encode("utf-8"))
+    return digest.hexdigest()
+
+
+def stored_version(conn: sqlite3.Connection) -> Optional[str]:
+    try:
+        result = conn.execute("SELECT value FROM meta WHERE key = 'parser_version'").fetchone()
+    except sqlite3.DatabaseError:
+        return None
+    return result[0] if result else None
+
+
+class ResultCache:
+    """
+    Page-level cache of extracted rows, keyed by page title and revision SHA1, stored in SQLite along with the
+    page's template counters (see `templates.coverage_stats`), so that cached pages still count in the report.
+
+    Each run reads from the cache left behind by the previous run (see `lookup`) and writes a fresh
+    cache next to it, which replaces the old one once the run completes. Pages that disappeared from
+    the dump are therefore dropped, and an interrupted run leaves the previous cache untouched.
+    A run resuming from a checkpoint (`resume`) keeps adding to the fresh cache of the interrupted run.
+    Both are discarded if they were written by a different `parser_version`.
+    """
+    def __init__(self, path: Path, resume: bool = False):
+        self.path = path
+        self.new_path = path.with_name(path.name + ".new")
+        if self.path.exists() and not self.current(self.path):
+            logging.info("The page cache {} was written by a different parser version, discarding it".format(path))
+            self.path.unlink()
+        if self.new_path.exists() and not (resume and self.intact() and self.current(self.new_path)):
+            self.new_path.unlink()
+        exists = self.new_path.exists()
+        self.conn = sqlite3.connect(self.new_path)
+        self.conn.execute("PRAGMA journal_mode = OFF")
+        self.conn.execute("PRAGMA synchronous = OFF")
+        if not exists:
+            self.conn.execute("CREATE TABLE pages (title TEXT PRIMARY KEY, sha1 TEXT NOT NULL, rows TEXT NOT NULL, "
+                              "template_stats TEXT NOT NULL)")
+            self.conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self.conn.execute("INSERT INTO meta VALUES ('parser_version', ?)", (parser_version(),))
+
+    def intact(self) -> bool:
+        """
+        Journaling is off, so a run killed mid-write can leave a corrupt cache behind.
+        """
+        try:
+            with sqlite3.connect(self.new_path) as conn:
+                return conn.execute("PRAGMA quick_check").fetchone()[0] == "ok"
+        except sqlite3.DatabaseError:
+            return False
+
+    @staticmethod
+    def current(path: Path) -> bool:
+        conn = sqlite3.connect(path)
+        try:
+            return stored_version(conn) == parser_version()
+        finally:
+            conn.close()
+
+    def store(self, title: str, sha1: Optional[str], rows: Iterable[Row], template_stats: Counter) -> None:
+        if sha1 is None:
+            return
+        self.conn.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)", (
+            title, sha1, json.dumps(rows),
+            json.dumps([[metric, name, value] for (metric, name), value in template_stats.items()])))
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
+        os.replace(self.new_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.conn.close()
+
+
+@lru_cache(maxsize=None)
+def cache_reader(path: Path) -> Optional[sqlite3.Connection]:
+    """
+    Opens (once per process) a read-only connection to the cache written by the previous run, unless it was
+    written by a different `parser_version`.
+    """
+    if not path.exists():
+        return None
+    conn = sqlite3.connect("file:{}?mode=ro".format(path), uri=True)
+    if stored_version(conn) != parser_version():
+        conn.close()
+        return None
+    return conn
+
+
+def lookup(path: Path, title: str, sha1: Optional[str]) -> Optional[Tuple[List[Row], Counter]]:
+    """
+    Returns the cached rows and template counters for a page if the page is unchanged since the previous run,
+    otherwise None.
+    """
+    conn = cache_reader(path)
+    if conn is None or sha1 is None:
+        return None
+    result = conn.execute("SELECT rows, template_stats FROM pages WHERE title = ? AND sha1 = ?",
+                          (title, sha1)).fetchone()
+    if result is None:
+        return None
+    return ([tuple(row) for row in json.loads(result[0])],
+            Counter({(metric, name): value for metric, name, value in json.loads(result[1])}))
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import logging
+import os
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Optional
+
+# Seconds between checkpoints
+CHECKPOINT_INTERVAL = 300
+# Bytes before the checkpointed end of the output that identify it when resuming
+OUTPUT_TAIL_SIZE = 1024 * 1024
+
+
+class Checkpoint:
+    """
+    Progress of a run, saved periodically so that an interrupted run can pick up where it left off: the
+    number of batches (in dump order) whose rows are fully written, the size of the output file at that
+    point, and the counters gathered so far.
+
+    Batches are only reproducible with the same input and settings, which are recorded as `config` (the input
+    by its identity, see `file_identity`); a checkpoint left behind by a run with a different config is refused
+    rather than silently misapplied. The output at `output_path` is only truncated back to the checkpoint if it
+    still ends with what was written up to it, so that a file replaced since (e.g. by another run) is left alone.
+    """
+    def __init__(self, path: Path, config: Dict, output_path: Path):
+        self.path = path
+        self.config = config
+        self.output_path = output_path
+        self.batches = 0
+        self.output_offset: Optional[int] = None
+        self.entries_parsed = 0
+        self.stats = Counter()
+        self.template_stats = Counter()
+        if path.exists():
+            self.load()
+
+    def load(self) -> None:
+        with open(self.path) as f_in:
+            saved = json.load(f_in)
+        if saved["config"] != self.config:
+            raise ValueError("Checkpoint {} was written by a run with different settings ({}), delete it to start "
+                             "over".format(self.path, saved["config"]))
+        if saved.get("output_tail") != tail_digest(self.output_path, saved["output_offset"]):
+            raise ValueError("{} changed since checkpoint {} was saved, delete the checkpoint to start over".format(
+                self.output_path, self.path))
+        self.batches = saved["batches"]
+        self.output_offset = saved["output_offset"]
+        self.entries_parsed = saved["entries_parsed"]
+        self.stats = Counter(saved["stats"])
+        self.template_stats = Counter({(metric, name): value for metric, name, value in saved["template_stats"]})
+        logging.info("Resuming from checkpoint {}: {} batches and {} entries already done".format(
+            self.path, self.batches, self.entries_parsed))
+
+    @property
+    def resumed(self) -> bool:
+        return self.output_offset is not None
+
+    def save(self, batches: int, output_offset: int, entries_parsed: int, stats: Counter,
+             template_stats: Counter) -> None:
+        """
+        Records progress atomically: a crash while saving leaves the previous checkpoint in place.
+        """
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as f_out:
+            json.dump({"config": self.config, "batches": batches, "output_offset": output_offset,
+                       "output_tail": tail_digest(self.output_path, output_offset),
+                       "entries_parsed": entries_parsed, "stats": stats,
+                       "template_stats": [[metric, name, value] for (metric, name), value in template_stats.items()]},
+                      f_out)
+        os.replace(tmp_path, self.path)
+
+    def remove(self) -> None:
+        if self.path.exists():
+            self.path.unlink()
+
+
+def file_identity(path: Path) -> Dict:
+    """
+    Size and modification time of an input file, which change whenever it's replaced (e.g. by the next dump).
+    """
+    stat = path.stat()
+    return {"path": str(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def tail_digest(path: Path, offset: int) -> Optional[str]:
+    """
+    SHA1 of the `OUTPUT_TAIL_SIZE` bytes of `path` before `offset`, or None if the file is shorter than that.
+    Rows are appended past the checkpoint until the run stops, so the file's size and mtime can't identify it.
+    """
+    if not path.exists() or path.stat().st_size < offset:
+        return None
+    with open(path, "rb") as f_in:
+        f_in.seek(max(offset - OUTPUT_TAIL_SIZE, 0))
+        return hashlib.sha1(f_in.read(offset - f_in.tell())).hexdigest()
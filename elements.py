@@ -1,15 +1,25 @@
 import csv
+import sys
 import uuid, base64
-from dataclasses import dataclass
 from functools import lru_cache
 from pathlib import Path
-from typing import Optional, Tuple, Dict
+from typing import NamedTuple, Optional, Tuple, Dict
 
 LANG_CODE_PATH = Path.cwd().joinpath("wiktionary_codes.csv")
+# Per-process number of memoized term ids
+TERM_ID_CACHE_SIZE = 64 * 1024
 
+class Page(NamedTuple):
+    title: str
+    text: Optional[str]
+    sha1: Optional[str] = None
 
-@dataclass(frozen=True)
-class Etymology:
+
+Row = Tuple[str, str, str, str, Optional[str], Optional[str], Optional[str], int, Optional[str],
+            Optional[str], Optional[int]]
+
+
+class EtymologyFields(NamedTuple):
     lang: str
     term: str
     reltype: str
@@ -20,6 +30,20 @@ class Etymology:
     parent_tag: str = None
     parent_position: int = None
 
+
+class Etymology(EtymologyFields):
+    """
+    A single relation, stored as a plain tuple (no per-instance `__dict__`) so that millions of them stay
+    small in memory and pickle compactly. Language codes and relation types come from a small vocabulary,
+    so they're interned: every row shares one copy of each, which pickle also writes only once per message.
+    """
+    __slots__ = ()
+
+    def __new__(cls, lang: str, term: str, reltype: str, related_lang: Optional[str], related_term: Optional[str],
+                position: int = 0, group_tag: str = None, parent_tag: str = None, parent_position: int = None):
+        return super().__new__(cls, intern(lang), term, intern(reltype), intern(related_lang), related_term,
+                               position, group_tag, parent_tag, parent_position)
+
     @classmethod
     def with_parent(cls, child: "Etymology", parent: "Etymology", position: int = 0):
         return cls(lang=child.lang, term=child.term, reltype=child.reltype, related_lang=child.related_lang,
@@ -27,10 +51,18 @@ class Etymology:
                    parent_tag=parent.group_tag, parent_position=position)
 
     @staticmethod
+    @lru_cache(maxsize=TERM_ID_CACHE_SIZE)
     def make_uuid(*terms):
         uuid_id = uuid.uuid5(uuid.NAMESPACE_OID, "^".join((str(t) for t in terms)))
         return base64.urlsafe_b64encode(uuid_id.bytes).decode("ascii").rstrip("=")
 
+    @staticmethod
+    def term_key(term_id: str) -> int:
+        """
+        Compact surrogate key for a term: the first 8 bytes of its uuid as a signed 64-bit integer.
+        """
+        return int.from_bytes(base64.urlsafe_b64decode(term_id + "==")[:8], "big", signed=True)
+
     @property
     def term_id(self) -> str:
         return self.make_uuid(self.lang, self.term)
@@ -60,13 +92,16 @@ class Etymology:
              "related_term", "position", "group_tag", "parent_tag", "parent_position")
         return h
 
-    def to_row(self) -> Tuple[str, str, str, str, Optional[str], Optional[str], Optional[str], int, Optional[str],
-                              Optional[str], Optional[int]]:
+    def to_row(self) -> Row:
         row = (self.term_id, self.lang, self.term, self.reltype, self.related_term_id, self.related_lang_full,
                self.related_term, self.position, self.group_tag, self.parent_tag, self.parent_position)
         return row
 
 
+def intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if type(value) is str else value
+
+
 @lru_cache(maxsize=1)
 def lang_dict() -> Dict[str, str]:
     with open(LANG_CODE_PATH, 'r') as f_in:
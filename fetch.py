@@ -0,0 +1,247 @@
+import hashlib
+import io
+import logging
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Generator, List, Optional, Tuple
+
+import requests
+
+CHUNK_SIZE = 1024 * 1024
+TIMEOUT = 60
+RETRIES = 5
+
+
+def download(url: str, path: Path, connections: int = 1, checksums_url: Optional[str] = None) -> None:
+    """
+    Streams the file at the URL to `path` in chunks, never holding more than `CHUNK_SIZE` bytes in memory.
+
+    Data is written to `<path>.part*` files that survive interruptions: a rerun resumes them with HTTP Range
+    requests, as long as the file's validator (ETag or Last-Modified, kept in `<path>.validator`) hasn't changed,
+    e.g. with the `latest` dump replaced by the next one. Parts of another file or of a different split are
+    deleted. If the server supports ranges, `connections` > 1 splits the file into that many segments
+    downloaded in parallel. If `checksums_url` points at a published md5/sha1 sums file, the result is verified
+    against it (as is an already existing file) before being atomically renamed into place.
+    """
+    expected = published_checksum(checksums_url, path.name) if checksums_url else None
+    if path.exists():
+        if expected is None or file_digest(path, checksum_algorithm(checksums_url)) == expected:
+            logging.info("File already exists, skipping download.")
+            return
+        logging.warning("{} doesn't match its published checksum, downloading it again.".format(path))
+        path.unlink()
+
+    logging.info("Downloading {}".format(url))
+    head = requests.head(url, allow_redirects=True, timeout=TIMEOUT)
+    head.raise_for_status()
+    size = int(head.headers.get("Content-Length", 0))
+    if not (size and head.headers.get("Accept-Ranges") == "bytes"):
+        size, connections = None, 1
+
+    segments = segment_ranges(size, connections)
+    part_paths = [path.with_name("{}.part{}of{}".format(path.name, i + 1, len(segments)))
+                  for i in range(len(segments))]
+    validator = range_validator(head.headers)
+    clear_stale_parts(path, part_paths, validator)
+    with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+        list(executor.map(download_segment, [url] * len(segments), part_paths, segments,
+                          [validator] * len(segments)))
+
+    tmp_path = part_paths[0]
+    if len(part_paths) > 1:
+        tmp_path = path.with_name(path.name + ".part")
+        with open(tmp_path, "wb") as f_out:
+            for part_path in part_paths:
+                with open(part_path, "rb") as f_in:
+                    shutil.copyfileobj(f_in, f_out, CHUNK_SIZE)
+        for part_path in part_paths:
+            part_path.unlink()
+    validator_path(path).unlink(missing_ok=True)
+
+    if expected is not None and file_digest(tmp_path, checksum_algorithm(checksums_url)) != expected:
+        tmp_path.unlink()
+        raise ValueError("Checksum mismatch for {}".format(url))
+    os.replace(tmp_path, path)
+    logging.info("Downloaded {}".format(url))
+
+
+class TeeReader(io.RawIOBase):
+    """
+    Read-only file object over a streaming HTTP response that copies every byte read to `f_out`
+    and hashes it on the way through. `size` is the length of the response, if known.
+    """
+    def __init__(self, source, f_out, algorithm: str = "sha1", size: Optional[int] = None):
+        self.source = source
+        self.size = size
+        self.f_out = f_out
+        self.digest = hashlib.new(algorithm)
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.bytes_read
+
+    def readinto(self, b) -> int:
+        data = self.source.read(len(b))
+        n = len(data)
+        b[:n] = data
+        self.f_out.write(data)
+        self.digest.update(data)
+        self.bytes_read += n
+        return n
+
+    def drain(self) -> None:
+        """
+        Copies whatever the consumer didn't read (e.g. trailing bytes after the end of the XML document).
+        """
+        while self.read(CHUNK_SIZE):
+            pass
+
+
+@contextmanager
+def tee_download(url: str, path: Path, checksums_url: Optional[str] = None) -> Generator[TeeReader, None, None]:
+    """
+    Streams the file at the URL as a readable file object, so that it can be consumed while it
+    downloads, and saves a copy to `path` for later runs. The copy is written to `<path>.part`,
+    verified against the published checksum (if any) and only renamed into place once the whole
+    file has been received and the consumer finished without errors.
+    """
+    expected = published_checksum(checksums_url, path.name) if checksums_url else None
+    algorithm = checksum_algorithm(checksums_url) if checksums_url else "sha1"
+    tmp_path = path.with_name(path.name + ".part")
+    logging.info("Streaming {}".format(url))
+    with requests.get(url, stream=True, timeout=TIMEOUT) as r:
+        r.raise_for_status()
+        with open(tmp_path, "wb") as f_out:
+            size = r.headers.get("Content-Length")
+            tee = TeeReader(r.raw, f_out, algorithm, int(size) if size else None)
+            yield tee
+            tee.drain()
+    if expected is not None and tee.digest.hexdigest() != expected:
+        tmp_path.unlink()
+        raise ValueError("Checksum mismatch for {}".format(url))
+    os.replace(tmp_path, path)
+    logging.info("Downloaded {}".format(url))
+
+
+def segment_ranges(size: Optional[int], connections: int) -> List[Tuple[int, Optional[int]]]:
+    """
+    Splits `size` bytes into `connections` inclusive (start, end) byte ranges. An unknown size
+    yields a single open-ended range.
+    """
+    if size is None:
+        return [(0, None)]
+    step = -(-size // max(connections, 1))
+    return [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+
+def validator_path(path: Path) -> Path:
+    return path.with_name(path.name + ".validator")
+
+
+def range_validator(headers) -> Optional[str]:
+    """
+    The strong validator identifying the version of a file, for `If-Range`: its ETag, unless it's a weak one,
+    otherwise its Last-Modified date.
+    """
+    etag = headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return headers.get("Last-Modified")
+
+
+def clear_stale_parts(path: Path, part_paths: List[Path], validator: Optional[str]) -> None:
+    """
+    Deletes the `<path>.part*` files that can't be resumed: all of them if they were downloaded from a different
+    version of the file (or one that can't be told apart, without a validator), otherwise those of a different
+    split (another number of connections). Then records `validator` for the parts about to be written.
+    """
+    saved = validator_path(path).read_text() if validator_path(path).exists() else None
+    for part_path in path.parent.glob(path.name + ".part*"):
+        if validator is None or saved != validator or part_path not in part_paths:
+            logging.info("Deleting {}, which can't be resumed".format(part_path))
+            part_path.unlink()
+    if validator is None:
+        validator_path(path).unlink(missing_ok=True)
+    else:
+        validator_path(path).write_text(validator)
+
+
+def download_segment(url: str, part_path: Path, byte_range: Tuple[int, Optional[int]],
+                     validator: Optional[str] = None) -> None:
+    """
+    Downloads one byte range of the URL into `part_path`, resuming from whatever is already there
+    and retrying (from the new position) on connection errors. Range requests are conditional on `validator`,
+    so that bytes of a different version of the file are never appended.
+    """
+    start, end = byte_range
+    for attempt in range(RETRIES):
+        done = part_path.stat().st_size if part_path.exists() else 0
+        if end is not None and start + done > end:
+            return
+        headers = {}
+        if end is not None:
+            headers["Range"] = "bytes={}-{}".format(start + done, end)
+            if validator is not None:
+                headers["If-Range"] = validator
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=TIMEOUT) as r:
+                r.raise_for_status()
+                if end is not None and r.status_code != 206:
+                    if validator is not None and range_validator(r.headers) != validator:
+                        raise ValueError("{} changed during the download, rerun to start over".format(url))
+                    raise ValueError("Server ignored the range request for {}".format(url))
+                with open(part_path, "ab" if end is not None else "wb") as f_out:
+                    for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                        f_out.write(chunk)
+            if end is None:
+                return
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            logging.warning("Download of {} interrupted (attempt {}/{}), resuming: {}".format(
+                url, attempt + 1, RETRIES, e))
+    done = part_path.stat().st_size if part_path.exists() else 0
+    if end is None or start + done <= end:
+        raise IOError("Failed to download {} after {} attempts".format(url, RETRIES))
+
+
+def checksum_algorithm(checksums_url: str) -> str:
+    return "md5" if "md5" in checksums_url.rsplit("/", 1)[-1] else "sha1"
+
+
+def dump_key(filename: str) -> str:
+    """
+    The sums files list dated file names (`enwiktionary-20231201-...`) while we download `latest` aliases.
+    """
+    return re.sub(r"^([^-]+)-(\d{8}|latest)-", r"\1-", filename)
+
+
+def published_checksum(checksums_url: str, filename: str) -> Optional[str]:
+    """
+    Looks up the published digest for `filename` in a dump's md5sums/sha1sums file.
+    """
+    try:
+        r = requests.get(checksums_url, timeout=TIMEOUT)
+        r.raise_for_status()
+    except requests.RequestException:
+        logging.warning("Could not fetch checksums from {}, skipping verification.".format(checksums_url))
+        return None
+    for line in r.text.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and dump_key(parts[1]) == dump_key(filename):
+            return parts[0]
+    logging.warning("No published checksum for {}, skipping verification.".format(filename))
+    return None
+
+
+def file_digest(path: Path, algorithm: str) -> str:
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f_in:
+        for chunk in iter(lambda: f_in.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,283 @@
+"""
+In-memory etymology graph built from the output of `main.write_all`.
+
+Terms are numbered as they're read and every row becomes an entry in a few flat `array`s; rows are then
+grouped by term (and, for the reverse direction, by related term) into CSR offset arrays, so that following
+the relations of a term is a slice instead of a scan.
+
+    python graph.py ancestors English word --depth 3 --reltype inherited_from borrowed_from
+    python graph.py descendants "Proto-Indo-European" "*wĺ̥kʷos"
+    python graph.py path English wolf Latin lupus --undirected
+    python graph.py groups English wolf
+"""
+import argparse
+import csv
+import gzip
+import json
+import logging
+import sys
+import time
+from array import array
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from elements import Etymology
+
+ETYMOLOGY_PATH = Path.cwd().joinpath("etymology.csv.gz")
+NO_TERM = -1
+
+
+class Term(NamedTuple):
+    term_id: str
+    lang: str
+    term: str
+
+
+class Relation(NamedTuple):
+    term: Term
+    reltype: str
+    related: Optional[Term]
+    position: int
+    parent_position: Optional[int]
+    children: List["Relation"]
+
+
+def csr(keys: array, count: int) -> Tuple[array, array]:
+    """
+    Counting sort of row ids by key: the rows with key `k` are `rows[offsets[k]:offsets[k + 1]]`.
+    Rows whose key is `NO_TERM` are left out.
+    """
+    offsets = array("l", bytes(8 * (count + 1)))
+    for key in keys:
+        if key != NO_TERM:
+            offsets[key + 1] += 1
+    for i in range(count):
+        offsets[i + 1] += offsets[i]
+    fill = array("l", offsets)
+    rows = array("l", bytes(8 * offsets[count]))
+    for row, key in enumerate(keys):
+        if key != NO_TERM:
+            rows[fill[key]] = row
+            fill[key] += 1
+    return offsets, rows
+
+
+class EtymologyGraph:
+    """
+    Terms are nodes; every row with a related term is an edge from the term to the related term, so
+    "ancestors" follow edges forwards and "descendants" follow them backwards.
+    """
+    def __init__(self):
+        self.term_index: Dict[str, int] = {}
+        self.terms: List[Term] = []
+        self.reltypes: List[str] = []
+        self.row_term = array("l")
+        self.row_related = array("l")
+        self.row_reltype = array("B")
+        self.row_position = array("l")
+        self.row_parent_position = array("l")
+        self.row_group = array("l")
+        self.row_parent = array("l")
+        self.forward = self.backward = None
+
+    @classmethod
+    def load(cls, path: Path = ETYMOLOGY_PATH) -> "EtymologyGraph":
+        graph = cls()
+        reltype_codes: Dict[str, int] = {}
+        tags: Dict[str, int] = {}
+        start = time.perf_counter()
+        with gzip.open(path, "rt") as f_in:
+            reader = csv.reader(f_in)
+            next(reader)
+            for (term_id, lang, term, reltype, related_term_id, related_lang, related_term, position,
+                 group_tag, parent_tag, parent_position) in reader:
+                if reltype not in reltype_codes:
+                    reltype_codes[reltype] = len(graph.reltypes)
+                    graph.reltypes.append(reltype)
+                graph.row_term.append(graph.add_term(term_id, lang, term))
+                graph.row_related.append(graph.add_term(related_term_id, related_lang, related_term)
+                                         if related_term_id else NO_TERM)
+                graph.row_reltype.append(reltype_codes[reltype])
+                graph.row_position.append(int(position or 0))
+                graph.row_parent_position.append(int(parent_position) if parent_position else -1)
+                graph.row_group.append(tags.setdefault(group_tag, len(tags)) if group_tag else -1)
+                graph.row_parent.append(tags.setdefault(parent_tag, len(tags)) if parent_tag else -1)
+        graph.index()
+        logging.info("Loaded {} terms and {} rows in {:.1f}s".format(
+            len(graph.terms), len(graph.row_term), time.perf_counter() - start))
+        return graph
+
+    def add_term(self, term_id: str, lang: str, term: str) -> int:
+        index = self.term_index.get(term_id)
+        if index is None:
+            index = self.term_index[term_id] = len(self.terms)
+            self.terms.append(Term(term_id, sys.intern(lang), term))
+        return index
+
+    def index(self) -> None:
+        self.forward = csr(self.row_term, len(self.terms))
+        self.backward = csr(self.row_related, len(self.terms))
+
+    def find(self, lang: str, term: str) -> Optional[int]:
+        return self.term_index.get(Etymology.make_uuid(lang, term))
+
+    def rows(self, index: int, backward: bool = False) -> array:
+        offsets, rows = self.backward if backward else self.forward
+        return rows[offsets[index]:offsets[index + 1]]
+
+    def reltype_filter(self, reltypes: Optional[Iterable[str]]) -> Optional[set]:
+        if reltypes is None:
+            return None
+        return {code for code, reltype in enumerate(self.reltypes) if reltype in reltypes}
+
+    def traverse(self, lang: str, term: str, backward: bool, max_depth: Optional[int] = None,
+                 reltypes: Optional[Iterable[str]] = None) -> List[Tuple[Term, int, str]]:
+        """
+        Breadth-first walk from a term, returning (term, depth, reltype of the edge it was reached by)
+        for every term reached, each once at its smallest depth.
+        """
+        start = self.find(lang, term)
+        if start is None:
+            return []
+        allowed = self.reltype_filter(reltypes)
+        other = self.row_term if backward else self.row_related
+        seen = {start}
+        queue = deque([(start, 0)])
+        found = []
+        while queue:
+            index, depth = queue.popleft()
+            if max_depth is not None and depth >= max_depth:
+                continue
+            for row in self.rows(index, backward):
+                code = self.row_reltype[row]
+                if allowed is not None and code not in allowed:
+                    continue
+                neighbour = other[row]
+                if neighbour == NO_TERM or neighbour in seen:
+                    continue
+                seen.add(neighbour)
+                found.append((self.terms[neighbour], depth + 1, self.reltypes[code]))
+                queue.append((neighbour, depth + 1))
+        return found
+
+    def ancestors(self, lang: str, term: str, max_depth: Optional[int] = None,
+                  reltypes: Optional[Iterable[str]] = None) -> List[Tuple[Term, int, str]]:
+        return self.traverse(lang, term, False, max_depth, reltypes)
+
+    def descendants(self, lang: str, term: str, max_depth: Optional[int] = None,
+                    reltypes: Optional[Iterable[str]] = None) -> List[Tuple[Term, int, str]]:
+        return self.traverse(lang, term, True, max_depth, reltypes)
+
+    def path(self, source: Tuple[str, str], target: Tuple[str, str], undirected: bool = False,
+             reltypes: Optional[Iterable[str]] = None) -> Optional[List[Tuple[Term, Optional[str]]]]:
+        """
+        Shortest chain of relations from `source` to `target` (both (lang, term)), as (term, reltype of the
+        edge leading to it) pairs starting with the source. Follows ancestry only, unless `undirected`,
+        which also walks back down to descendants (e.g. to link cognates through a shared ancestor).
+        """
+        start, end = self.find(*source), self.find(*target)
+        if start is None or end is None:
+            return None
+        allowed = self.reltype_filter(reltypes)
+        directions = [(False, self.row_related)]
+        if undirected:
+            directions.append((True, self.row_term))
+        previous = {start: None}
+        queue = deque([start])
+        while queue and end not in previous:
+            index = queue.popleft()
+            for backward, other in directions:
+                for row in self.rows(index, backward):
+                    neighbour = other[row]
+                    if neighbour == NO_TERM or neighbour in previous:
+                        continue
+                    if allowed is not None and self.row_reltype[row] not in allowed:
+                        continue
+                    previous[neighbour] = (index, row)
+                    queue.append(neighbour)
+        if end not in previous:
+            return None
+        chain = []
+        index = end
+        while previous[index] is not None:
+            parent, row = previous[index]
+            chain.append((self.terms[index], self.reltypes[self.row_reltype[row]]))
+            index = parent
+        chain.append((self.terms[start], None))
+        chain.reverse()
+        return chain
+
+    def groups(self, lang: str, term: str) -> List[Relation]:
+        """
+        Rebuilds the nested structure of a term's relations from `group_tag`/`parent_tag`: top-level relations
+        (ungrouped rows and group roots) with the rows of each group as its children, in `parent_position` order.
+        """
+        index = self.find(lang, term)
+        if index is None:
+            return []
+        rows = self.rows(index)
+        children: Dict[int, List[int]] = {}
+        for row in rows:
+            if self.row_parent[row] != -1:
+                children.setdefault(self.row_parent[row], []).append(row)
+
+        def build(row: int) -> Relation:
+            nested = sorted(children.get(self.row_group[row], []) if self.row_group[row] != -1 else [],
+                            key=lambda child: self.row_parent_position[child])
+            related = self.row_related[row]
+            parent_position = self.row_parent_position[row]
+            return Relation(self.terms[self.row_term[row]], self.reltypes[self.row_reltype[row]],
+                            self.terms[related] if related != NO_TERM else None, self.row_position[row],
+                            parent_position if parent_position != -1 else None, [build(child) for child in nested])
+
+        return [build(row) for row in rows if self.row_parent[row] == -1]
+
+
+def relation_json(relation: Relation) -> Dict:
+    return {"reltype": relation.reltype, "related": relation.related._asdict() if relation.related else None,
+            "position": relation.position, "parent_position": relation.parent_position,
+            "children": [relation_json(child) for child in relation.children]}
+
+
+def main_cli(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Query the etymology graph.")
+    parser.add_argument("--input", type=Path, default=ETYMOLOGY_PATH, help="Output of main.py (etymology.csv.gz).")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name in ("ancestors", "descendants"):
+        command = commands.add_parser(name)
+        command.add_argument("lang")
+        command.add_argument("term")
+        command.add_argument("--depth", type=int, default=None, help="Maximum number of relations to follow.")
+        command.add_argument("--reltype", nargs="+", default=None, help="Only follow these relation types.")
+    path_parser = commands.add_parser("path", help="Shortest chain of relations between two terms.")
+    for arg in ("source_lang", "source_term", "target_lang", "target_term"):
+        path_parser.add_argument(arg)
+    path_parser.add_argument("--undirected", action="store_true", help="Also follow relations to descendants.")
+    path_parser.add_argument("--reltype", nargs="+", default=None, help="Only follow these relation types.")
+    groups_parser = commands.add_parser("groups", help="Nested relations of a term.")
+    groups_parser.add_argument("lang")
+    groups_parser.add_argument("term")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level="INFO")
+    graph = EtymologyGraph.load(args.input)
+    start = time.perf_counter()
+    if args.command in ("ancestors", "descendants"):
+        found = graph.traverse(args.lang, args.term, args.command == "descendants", args.depth, args.reltype)
+        for term, depth, reltype in found:
+            print("{}\t{}\t{}\t{}".format(depth, reltype, term.lang, term.term))
+    elif args.command == "path":
+        found = graph.path((args.source_lang, args.source_term), (args.target_lang, args.target_term),
+                           args.undirected, args.reltype)
+        for term, reltype in found or []:
+            print("{}\t{}\t{}".format(reltype or "", term.lang, term.term))
+    else:
+        found = graph.groups(args.lang, args.term)
+        print(json.dumps([relation_json(relation) for relation in found], ensure_ascii=False, indent=2))
+    logging.info("Query took {:.1f} ms".format((time.perf_counter() - start) * 1000))
+    return 0 if found else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
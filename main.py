@@ -1,15 +1,20 @@
+import argparse
 import bz2
-import gzip
-import csv
+import json
 import logging
+import os
 import re
+from collections import Counter
+from contextlib import ExitStack
+from functools import partial
+from itertools import islice
 from multiprocessing import Pool, freeze_support
-from datetime import datetime, timedelta
+from datetime import timedelta
+from time import monotonic
 from pathlib import Path
-from typing import Generator, List, Tuple
+from typing import BinaryIO, Callable, Dict, Generator, Iterator, List, Optional, Tuple, Union
 
 import mwparserfromhell as mwp
-import requests
 from lxml import etree
 from mwparserfromhell.nodes.extras import Parameter
 from mwparserfromhell.nodes.template import Template
@@ -17,86 +22,522 @@ from mwparserfromhell.nodes.text import Text
 from mwparserfromhell.nodes.wikilink import Wikilink
 from mwparserfromhell.wikicode import Wikicode
 
-from elements import Etymology
-from templates import parse_template, unparsed_templates
+import cache
+from checkpoint import CHECKPOINT_INTERVAL, Checkpoint, file_identity
+from elements import Etymology, Page, Row
+from fetch import download, published_checksum, tee_download
+from pipeline import BoundedPipeline
+from scope import Scope, load_titles
+from sections import etymology_sections
+from shards import ZSTD_THREADS, clear_shards, merge_shards, write_manifest, write_shard
+from telemetry import TELEMETRY_INTERVAL, Telemetry
+from writers import CsvWriter, NormalizedWriter, ParquetWriter, SqliteWriter
+from templates import coverage_stats, parse_template, pop_template_stats
 
 NAMESPACE = "{http://www.mediawiki.org/xml/export-0.10/}"
 
 WIKI_FILENAME = "enwiktionary-latest-pages-articles.xml.bz2"
 WIKTIONARY_URL = "https://dumps.wikimedia.your.org/enwiktionary/latest/{}".format(WIKI_FILENAME)
 
+MULTISTREAM_FILENAME = "enwiktionary-latest-pages-articles-multistream.xml.bz2"
+MULTISTREAM_INDEX_FILENAME = "enwiktionary-latest-pages-articles-multistream-index.txt.bz2"
+MULTISTREAM_URL = "https://dumps.wikimedia.your.org/enwiktionary/latest/{}".format(MULTISTREAM_FILENAME)
+MULTISTREAM_INDEX_URL = "https://dumps.wikimedia.your.org/enwiktionary/latest/{}".format(MULTISTREAM_INDEX_FILENAME)
+SHA1SUMS_URL = "https://dumps.wikimedia.your.org/enwiktionary/latest/enwiktionary-latest-sha1sums.txt"
+
 
 DOWNLOAD_PATH = Path("/tmp").joinpath(WIKI_FILENAME)
+MULTISTREAM_PATH = Path("/tmp").joinpath(MULTISTREAM_FILENAME)
+MULTISTREAM_INDEX_PATH = Path("/tmp").joinpath(MULTISTREAM_INDEX_FILENAME)
 OUTPUT_DIR = Path.cwd()
 ETYMOLOGY_PATH = OUTPUT_DIR.joinpath("etymology.csv.gz")
+PARQUET_PATH = OUTPUT_DIR.joinpath("etymology.parquet")
+NORMALIZED_DIR = OUTPUT_DIR.joinpath("normalized")
+SHARDS_DIR = OUTPUT_DIR.joinpath("shards")
+SQLITE_PATH = OUTPUT_DIR.joinpath("etymology.db")
+TEMPLATE_REPORT_PATH = OUTPUT_DIR.joinpath("template_report.json")
+
+# Target amount of wikitext (in characters) per work unit sent to a worker
+BATCH_SIZE = 1024 * 1024
+# Default backpressure limits, per worker process: work units submitted but not yet parsed,
+# and parsed work units waiting to be written
+IN_FLIGHT_BATCHES = 2
+WAITING_BATCHES = 2
+# Seconds between two updates of the progress line
+PROGRESS_INTERVAL = 1
+
+# Any heading line mentioning "Etymology" -- a superset of what `parse_wikitext` matches with `get_sections`
+ETYMOLOGY_HEADING = re.compile(r"^=+[^\n]*etymology", re.IGNORECASE | re.MULTILINE)
+
+
+# (title, sha1, rows, template counters for the page cache) of a parsed page
+PageResult = Tuple[str, Optional[str], List[Row], Optional[Counter]]
+# A worker's shard file name and the number of rows it just appended to it
+ShardResult = Tuple[str, int]
 
 
 def tag(s: str):
     return NAMESPACE + s
 
 
-def download(url: str) -> None:
+def has_etymology_heading(wikitext: Optional[str]) -> bool:
     """
-    Downloads the file at the URL to `DOWNLOAD_PATH`
+    Default prefilter: a regex scan of the raw text for an Etymology heading, run in the producer
+    so that pages without one are never pickled, sent to a worker or parsed.
     """
-    if DOWNLOAD_PATH.exists():
-        logging.info("File already exists, skipping download.")
-        return
+    return bool(wikitext) and ETYMOLOGY_HEADING.search(wikitext) is not None
+
+
+def write_all(multistream: bool = False, prefilter: Optional[Callable[[str], bool]] = has_etymology_heading,
+              lazy_sections: bool = False, fast_templates: bool = False, batch_size: int = BATCH_SIZE,
+              output_format: str = "csv", fts: bool = False, cache_path: Optional[Path] = None,
+              download_url: Optional[str] = None, template_report_path: Path = TEMPLATE_REPORT_PATH,
+              checkpoint_path: Optional[Path] = None, checkpoint_interval: float = CHECKPOINT_INTERVAL,
+              shard_codec: Optional[str] = None, merge: bool = False, max_pages_in_flight: Optional[int] = None,
+              max_chars_in_flight: Optional[int] = None, max_waiting_batches: Optional[int] = None,
+              scope: Optional[Scope] = None, stats_path: Optional[Path] = None, stats_port: Optional[int] = None,
+              stats_interval: float = TELEMETRY_INTERVAL, zstd_threads: int = ZSTD_THREADS):
+    """
+    Runs the full extraction. If `cache_path` is given, pages whose revision is unchanged since the
+    previous run reuse that run's rows instead of being parsed again, and the cache is rebuilt for the next run.
+    If `download_url` is given, the dump is parsed as it downloads and saved to `DOWNLOAD_PATH` along the way.
+    If `checkpoint_path` is given, progress is saved there every `checkpoint_interval` seconds and a run that
+    finds a checkpoint resumes from it. Batches are then written in dump order, so that the batches done at
+    a checkpoint are exactly those before a point in the dump (CSV output only). A checkpoint is only resumed from
+    with the same dump (see `checkpoint_input`) and an output file that wasn't replaced since.
+    If `shard_codec` ("gzip" or "zstd") is given, the workers compress and write their own CSV shards to
+    `SHARDS_DIR` along with a manifest, instead of sending rows to this process; `merge` then concatenates
+    the shards into the usual `ETYMOLOGY_PATH`. Each worker compresses zstd shards with `zstd_threads` threads.
+    Pages are only read from the dump while the pages sent to workers and not yet parsed stay under
+    `max_pages_in_flight` pages and `max_chars_in_flight` characters of wikitext, and while fewer than
+    `max_waiting_batches` parsed batches wait to be written, which bounds memory use whichever stage is slowest.
+    With no limits given, about `IN_FLIGHT_BATCHES` batches per worker are kept in flight.
+    A `scope` restricts the run to some languages and/or page titles; the page cache can't be used with it,
+    since cached rows cover all languages.
+    If `stats_path` or `stats_port` is given, run statistics (see `Telemetry`) are sampled every `stats_interval`
+    seconds and appended to `stats_path` as JSON lines and/or served on http://127.0.0.1:`stats_port`/.
+    """
+    stats = Counter()
+    worker_stats = Counter()
+    template_stats = Counter()
+    checkpoint = None
+    if shard_codec:
+        if output_format != "csv":
+            raise ValueError("Sharded output is CSV only")
+        if checkpoint_path:
+            raise ValueError("Checkpoints aren't supported for sharded output")
+        clear_shards(SHARDS_DIR)
+    shard_rows = Counter()
+    if scope and cache_path:
+        raise ValueError("The page cache can't be used for a scoped run")
+    if checkpoint_path:
+        if output_format != "csv":
+            raise ValueError("Checkpoints are only supported for CSV output")
+        checkpoint = Checkpoint(checkpoint_path, {
+            "input": checkpoint_input(multistream, download_url), "output": str(ETYMOLOGY_PATH),
+            "prefilter": getattr(prefilter, "__name__", None), "batch_size": batch_size,
+            "scope": scope.config() if scope else None}, ETYMOLOGY_PATH)
+        worker_stats.update(checkpoint.stats)
+        template_stats.update(checkpoint.template_stats)
+    resumed = checkpoint is not None and checkpoint.resumed
+    result_cache = cache.ResultCache(cache_path, resume=resumed) if cache_path else None
+    with ExitStack() as stack:
+        writer = None
+        if not shard_codec:
+            writer = stack.enter_context(open_writer(output_format, fts, checkpoint.output_offset if resumed else None))
+        input_file = DOWNLOAD_PATH
+        if download_url:
+            input_file = stack.enter_context(tee_download(download_url, DOWNLOAD_PATH, checksums_url=SHA1SUMS_URL))
+            input_size = input_file.size
+        else:
+            input_size = (MULTISTREAM_PATH if multistream else DOWNLOAD_PATH).stat().st_size
+        entries_parsed = checkpoint.entries_parsed if checkpoint else 0
+        batches_done = checkpoint.batches if checkpoint else 0
+        run_start = last_checkpoint = last_progress = monotonic()
+        write_seconds = 0.0
+        # Started before any other thread (telemetry, the pool's own handlers), as forking a threaded process
+        # can deadlock; the multistream dump is decompressed by the same workers
+        processes = os.cpu_count() or 1
+        pool = stack.enter_context(Pool(processes))
+        terms = stream_terms(multistream, prefilter=prefilter, stats=stats, input_file=input_file, scope=scope,
+                             pool=pool)
+        batches = batch_pages(terms, batch_size)
+        parse = partial(parse_batch, lazy_sections=lazy_sections, fast_templates=fast_templates,
+                        cache_path=cache_path, shard_dir=SHARDS_DIR if shard_codec else None, shard_codec=shard_codec,
+                        scope=scope, zstd_threads=zstd_threads)
+        if max_pages_in_flight is None and max_chars_in_flight is None:
+            max_chars_in_flight = IN_FLIGHT_BATCHES * processes * batch_size
+        pipeline = BoundedPipeline(pool, max_pages_in_flight, max_chars_in_flight,
+                                   max_waiting_batches or WAITING_BATCHES * processes, ordered=checkpoint is not None)
+        if checkpoint:
+            # Already written batches are still read from the dump, just not parsed again
+            batches = islice(batches, batches_done, None)
+        parsed_batches = pipeline.imap(parse, batches, measure_batch)
+
+        def sample() -> Dict:
+            return {"pages_read": stats["pages_read"], "pages_dispatched": pipeline.submitted_items,
+                    "rows_written": entries_parsed, "input_bytes_read": stats["input_bytes_read"],
+                    "input_bytes_total": input_size, "pages_in_flight": pipeline.items,
+                    "chars_in_flight": pipeline.size, "batches_waiting": len(pipeline.waiting),
+                    "worker_busy_seconds": {pid: round(seconds, 3)
+                                            for pid, seconds in pipeline.busy_seconds.copy().items()},
+                    "producer_stall_seconds": round(pipeline.stall_seconds, 3),
+                    "writer_stall_seconds": round(pipeline.wait_seconds, 3), "write_seconds": round(write_seconds, 3)}
+
+        if stats_path or stats_port is not None:
+            stack.enter_context(Telemetry(sample, stats_path, stats_port, stats_interval))
+        for results, batch_stats, batch_template_stats, shard in parsed_batches:
+            if checkpoint and monotonic() - last_checkpoint >= checkpoint_interval:
+                if result_cache:
+                    result_cache.commit()
+                checkpoint.save(batches_done, writer.checkpoint(), entries_parsed, worker_stats, template_stats)
+                last_checkpoint = monotonic()
+            batches_done += 1
+            worker_stats.update(batch_stats)
+            template_stats.update(batch_template_stats)
+            rows = []
+            for title, sha1, page_rows, page_template_stats in results:
+                if result_cache:
+                    result_cache.store(title, sha1, page_rows, page_template_stats)
+                rows.extend(page_rows)
+            if shard:
+                shard_rows[shard[0]] += shard[1]
+            entries_parsed += shard[1] if shard else len(rows)
+            if writer and rows:
+                start = monotonic()
+                writer.writerows(rows)
+                write_seconds += monotonic() - start
+            if monotonic() - last_progress >= PROGRESS_INTERVAL:
+                last_progress = monotonic()
+                elapsed = last_progress - run_start
+                print(f"Entries parsed: {entries_parsed} Pages read: {stats['pages_read']} "
+                      f"Time elapsed: {timedelta(seconds=int(elapsed))} "
+                      f"Entries per second: {entries_parsed / elapsed if elapsed else 0:.0f} "
+                      f"In flight: {pipeline.items} pages ({pipeline.size / 1e6:.1f}M characters) "
+                      f"Waiting: {len(pipeline.waiting)} batches{' ' * 10}", end="\r", flush=True)
+    stats.update(worker_stats)
+    logging.info("Peak queue depths: {} pages ({:.1f}M characters) in flight, {} batches waiting to be written; "
+                 "{:.1f}s spent waiting on workers ({:.1f}s of it with input ready), {:.1f}s writing".format(
+                     pipeline.peaks["items"], pipeline.peaks["size"] / 1e6, pipeline.peaks["waiting"],
+                     pipeline.wait_seconds, pipeline.stall_seconds, write_seconds))
+    if shard_codec:
+        write_manifest(SHARDS_DIR, shard_codec, shard_rows)
+        if merge:
+            merge_shards(SHARDS_DIR, ETYMOLOGY_PATH)
+    seconds = monotonic() - run_start
+    logging.info("Pages read: {} ({:.0f}/s, {:.1f} MB/s of XML), redirects skipped: {}, out of scope: {}, "
+                 "dropped by prefilter: {}".format(stats["pages_read"], stats["pages_read"] / seconds if seconds else 0,
+                                                   stats["xml_bytes_read"] / 2 ** 20 / seconds if seconds else 0,
+                                                   stats["pages_redirects"], stats["pages_out_of_scope"],
+                                                   stats["pages_dropped"]))
+    logging.info("Term id cache hits: {}, misses: {}".format(stats["term_id_cache_hits"],
+                                                             stats["term_id_cache_misses"]))
+    if result_cache:
+        result_cache.close()
+        logging.info("Page cache hits: {}, misses: {}".format(stats["page_cache_hits"], stats["page_cache_misses"]))
+    write_template_report(template_stats, template_report_path, stats["page_cache_hits"])
+    if checkpoint:
+        checkpoint.remove()
+
+
+def checkpoint_input(multistream: bool, download_url: Optional[str]) -> Dict:
+    """
+    Identifies the dump a checkpointed run reads: a local file by its size and mtime, and a streamed download by
+    its published checksum (without which it couldn't be told apart from the next month's dump).
+    """
+    if download_url:
+        checksum = published_checksum(SHA1SUMS_URL, DOWNLOAD_PATH.name)
+        if checksum is None:
+            raise ValueError("A streamed download can't be checkpointed without its published checksum")
+        return {"url": download_url, "sha1": checksum}
+    if multistream:
+        return {"dump": file_identity(MULTISTREAM_PATH), "index": file_identity(MULTISTREAM_INDEX_PATH)}
+    return file_identity(DOWNLOAD_PATH)
+
 
-    logging.info("Downloading {}".format(url))
-    r = requests.get(url)
-    with open(DOWNLOAD_PATH, 'wb') as f:
-        f.write(r.content)
-    logging.info("Downloaded {}".format(url))
-
-def write_all():
-    with gzip.open(ETYMOLOGY_PATH, "wt") as f_out:
-        writer = csv.writer(f_out)
-        writer.writerow(Etymology.header())
-        entries_parsed = 0
-        time = datetime.now()
-        for etys in Pool().imap_unordered(parse_wikitext, stream_terms()):
-            if not etys:
+def write_template_report(template_stats: Counter, path: Path, cached_pages: int = 0) -> None:
+    """
+    Writes the profiling counters gathered across all workers as JSON: per template name, how often it was
+    seen, not recognized, or raised; per parser function, how often it ran and the cumulative seconds spent in it,
+    excluding the parsers it called for nested templates. Template counts include the `cached_pages` served from
+    the page cache, parser counts and timings only cover the pages parsed in this run.
+    """
+    templates = {}
+    parsers = {}
+    for (metric, name), value in template_stats.items():
+        if metric.startswith("parser_"):
+            parsers.setdefault(name, {"calls": 0, "seconds": 0.0})[metric[len("parser_"):]] = value
+        else:
+            templates.setdefault(name, {"calls": 0, "unrecognized": 0, "errors": 0})[metric] = value
+    report = {
+        "cached_pages": cached_pages,
+        "templates": dict(sorted(templates.items(), key=lambda x: x[1]["calls"], reverse=True)),
+        "parsers": dict(sorted(parsers.items(), key=lambda x: x[1]["seconds"], reverse=True)),
+    }
+    with open(path, "w") as f_out:
+        json.dump(report, f_out, indent=2)
+    unrecognized = sum(t["unrecognized"] for t in templates.values())
+    logging.info("Template report written to {} ({} unrecognized template calls)".format(path, unrecognized))
+
+
+def open_writer(output_format: str, fts: bool = False, resume_offset: Optional[int] = None):
+    """
+    Opens the output backend for the given format. `fts` adds a full-text index on terms to SQLite output;
+    `resume_offset` continues CSV output from a checkpoint.
+    """
+    if output_format == "csv":
+        return CsvWriter(ETYMOLOGY_PATH, resume_offset)
+    if output_format == "parquet":
+        return ParquetWriter(PARQUET_PATH)
+    if output_format == "normalized":
+        return NormalizedWriter(NORMALIZED_DIR)
+    if output_format == "sqlite":
+        return SqliteWriter(SQLITE_PATH, fts=fts)
+    raise ValueError("Unknown output format `{}`".format(output_format))
+
+
+def stream_terms(multistream: bool = False, prefilter: Optional[Callable[[str], bool]] = None,
+                 stats: Optional[Counter] = None,
+                 input_file: Union[Path, BinaryIO] = DOWNLOAD_PATH, scope: Optional[Scope] = None,
+                 pool: Optional[Pool] = None) -> Generator[Page, None, None]:
+    """
+    Yields (title, wikitext, sha1) for every namespace-0 page in the dump that isn't a redirect. If a
+    `prefilter` is given, pages for which it returns False are dropped before they reach the workers; `stats`
+    (if given) is updated with the number of pages read, redirects skipped, pages dropped, and bytes of XML read.
+    `input_file` may be a path or a binary file object streaming the compressed dump (ignored for the
+    multistream dump, which needs random access). Pages outside of `scope` are dropped (and counted) by title
+    before their text is read, then by a search for their language headers before the prefilter runs.
+    The multistream dump is decompressed by the workers of `pool` (or of a pool of its own, if not given).
+
+    Only complete <page> elements are handed out by the parser, and each one is removed from the tree once
+    handled, along with anything before it, so memory use doesn't grow with the size of the dump.
+    """
+    stats = Counter() if stats is None else stats
+    if multistream:
+        yield from stream_terms_multistream(prefilter, stats, scope, pool)
+        return
+    with ExitStack() as stack:
+        f_raw = stack.enter_context(open(input_file, "rb")) if isinstance(input_file, Path) else input_file
+        f_in = stack.enter_context(bz2.open(f_raw, "rb"))
+        # The revision SHA1 follows the text, so pages are handled once they're complete
+        for event, page in etree.iterparse(f_in, tag=tag("page"), huge_tree=True):
+            stats["xml_bytes_read"] = f_in.tell()
+            stats["input_bytes_read"] = f_raw.tell()
+            if page.findtext(tag("ns")) == "0":
+                stats["pages_read"] += 1
+                title = page.findtext(tag("title"))
+                if page.find(tag("redirect")) is not None:
+                    stats["pages_redirects"] += 1
+                elif scope and not scope.title_in_scope(title):
+                    stats["pages_out_of_scope"] += 1
+                else:
+                    revision = page.find(tag("revision"))
+                    text = revision.findtext(tag("text"))
+                    if scope and not scope.text_in_scope(text):
+                        stats["pages_out_of_scope"] += 1
+                    elif prefilter and not prefilter(text):
+                        stats["pages_dropped"] += 1
+                    else:
+                        yield Page(title, text, revision.findtext(tag("sha1")))
+            page.clear()
+            while page.getprevious() is not None:
+                del page.getparent()[0]
+
+
+def stream_terms_multistream(prefilter: Optional[Callable[[str], bool]], stats: Counter,
+                             scope: Optional[Scope] = None, pool: Optional[Pool] = None) -> Generator[Page, None, None]:
+    """
+    Reads the multistream dump, in which every ~100 pages are compressed as an independent bz2 stream,
+    and decompresses/parses the streams in parallel, in `pool` if given. Pages are yielded in dump order.
+    The prefilter and scope run inside the decompressing workers.
+    """
+    spans = multistream_spans(MULTISTREAM_PATH, MULTISTREAM_INDEX_PATH)
+    processes = os.cpu_count() or 1
+    with ExitStack() as stack:
+        if pool is None:
+            pool = stack.enter_context(Pool(processes))
+        # Streams are only decompressed a few at a time ahead of the consumer
+        pipeline = BoundedPipeline(pool, max_items=IN_FLIGHT_BATCHES * processes,
+                                   max_waiting=WAITING_BATCHES * processes, ordered=True)
+        read_stream_scoped = partial(read_stream, prefilter=prefilter, scope=scope)
+        for pages, stream_stats in pipeline.imap(read_stream_scoped, spans, lambda span: (1, span[2])):
+            stats.update(stream_stats)
+            yield from pages
+
+
+def multistream_spans(dump_path: Path, index_path: Path) -> Iterator[Tuple[Path, int, int]]:
+    """
+    Turns the multistream index (lines of `offset:page_id:title`) into (path, offset, length) spans,
+    one per bz2 stream. The header stream precedes the first indexed offset and is skipped; the footer
+    stream is absorbed into the last span.
+    """
+    with bz2.open(index_path, "rt") as f_in:
+        offsets = []
+        for line in f_in:
+            offset = int(line.split(":", 1)[0])
+            if not offsets or offsets[-1] != offset:
+                offsets.append(offset)
+    offsets.append(dump_path.stat().st_size)
+    for start, end in zip(offsets, offsets[1:]):
+        yield dump_path, start, end - start
+
+
+def read_stream(span: Tuple[Path, int, int],
+                prefilter: Optional[Callable[[str], bool]] = None,
+                scope: Optional[Scope] = None) -> Tuple[List[Page], Counter]:
+    """
+    Decompresses a single bz2 stream of the multistream dump and extracts its namespace-0 pages that aren't
+    redirects, are in `scope` and pass the prefilter. Returns the pages along with the same producer statistics
+    `stream_terms` keeps (pages read, skipped as redirects or out of scope, or dropped, and bytes read).
+    Streams are fragments of the full document (no root element or XML namespace), so the pages
+    are wrapped in a synthetic root before parsing.
+    """
+    path, start, length = span
+    with open(path, "rb") as f_in:
+        f_in.seek(start)
+        data = bz2.decompress(f_in.read(length))
+    data = data.replace(b"</mediawiki>", b"")
+    root = etree.fromstring(b"<pages>" + data + b"</pages>", parser=etree.XMLParser(huge_tree=True))
+    pages = []
+    stats = Counter(input_bytes_read=length, xml_bytes_read=len(data))
+    for page in root.iterfind("page"):
+        if page.findtext("ns") == "0":
+            stats["pages_read"] += 1
+            if page.find("redirect") is not None:
+                stats["pages_redirects"] += 1
+                continue
+            title = page.findtext("title")
+            if scope and not scope.title_in_scope(title):
+                stats["pages_out_of_scope"] += 1
                 continue
+            text = page.findtext("revision/text")
+            if scope and not scope.text_in_scope(text):
+                stats["pages_out_of_scope"] += 1
+            elif prefilter and not prefilter(text):
+                stats["pages_dropped"] += 1
+            else:
+                pages.append(Page(title, text, page.findtext("revision/sha1")))
+    return pages, stats
+
+
+def batch_pages(pages: Iterator[Page], batch_size: int = BATCH_SIZE) -> Generator[List[Page], None, None]:
+    """
+    Groups pages into work units holding roughly `batch_size` characters of wikitext, so that each
+    IPC round trip carries many pages. Pages at least as large as a whole batch are dispatched
+    immediately on their own, ahead of the batch currently being filled.
+    """
+    batch = []
+    size = 0
+    for page in pages:
+        page_size = len(page.text or "")
+        if page_size >= batch_size:
+            yield [page]
+            continue
+        batch.append(page)
+        size += page_size
+        if size >= batch_size:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+
+def measure_batch(batch: List[Page]) -> Tuple[int, int]:
+    """
+    Pages and characters of wikitext a work unit holds while it's in flight, in the same unit as the batch size.
+    """
+    return len(batch), sum(len(page.text or "") for page in batch)
+
+
+def parse_batch(batch: List[Page], lazy_sections: bool = False, fast_templates: bool = False,
+                cache_path: Optional[Path] = None, shard_dir: Optional[Path] = None,
+                shard_codec: Optional[str] = None, scope: Optional[Scope] = None,
+                zstd_threads: int = ZSTD_THREADS) -> Tuple[List[PageResult], Counter, Counter, Optional[ShardResult]]:
+    """
+    Parses a whole work unit in the worker, returning (title, sha1, rows) for each of its pages in one message,
+    along with the worker-side run statistics and template profiling counters for the batch.
+    Rows are materialized here (term id hashing, language resolution) so the parent process only writes.
+    Pages found unchanged in the previous run's cache at `cache_path` are not parsed again, their template
+    counters being replayed from the cache instead; for parsed pages, those counters are sent back to be cached.
+    With `shard_dir`, the worker writes the rows to its own shard and returns the shard's name and the number
+    of rows written; the rows themselves are only sent back if the parent needs them for the page cache.
+    Only the sections of the languages in `scope` (if given) are parsed.
+    """
+    language_filter = scope.language_in_scope if scope and scope.languages is not None else None
+    cache_before = Etymology.make_uuid.cache_info()
+    stats = Counter()
+    batch_template_stats = Counter()
+    results = []
+    for page in batch:
+        cached = cache.lookup(cache_path, page.title, page.sha1) if cache_path else None
+        if cached is None:
+            etys = parse_wikitext(page, lazy_sections=lazy_sections, fast_templates=fast_templates,
+                                  language_filter=language_filter)
             rows = [e.to_row() for e in etys]
-            entries_parsed += len(rows)
-            writer.writerows(rows)
-            elapsed = (datetime.now() - time)
-            if elapsed.total_seconds() > 1:
-                elapsed -= timedelta(microseconds=elapsed.microseconds)
-            if entries_parsed % 1000 == 0:
-                print(f"Entries parsed: {entries_parsed} Time elapsed: {elapsed} "
-                      f"Entries per second: {entries_parsed // elapsed.total_seconds()}{' ' * 10}", end="\r", flush=True)
-
-
-def stream_terms() -> Generator[Tuple[str, str], None, None]:
-    with bz2.open(DOWNLOAD_PATH, "rb") as f_in:
-        for event, elem in etree.iterparse(f_in, huge_tree=True):
-            if elem.tag == tag("text"):
-                page = elem.getparent().getparent()
-                ns = page.find(tag("ns"))
-                if ns is not None and ns.text == "0":
-                    term = elem.getparent().getparent().find(tag("title")).text
-                    yield term, elem.text
-                page.clear()
-
-
-def parse_wikitext(unparsed_data: Tuple[str, str]) -> List[Etymology]:
-    term, unparsed_wikitext = unparsed_data
-    wikitext = mwp.parse(unparsed_wikitext)
+            page_template_stats = pop_template_stats()
+            batch_template_stats.update(page_template_stats)
+            page_template_stats = coverage_stats(page_template_stats) if cache_path else None
+            stats["page_cache_misses"] += 1
+        else:
+            rows, page_template_stats = cached
+            batch_template_stats.update(page_template_stats)
+            stats["page_cache_hits"] += 1
+        results.append((page.title, page.sha1, rows, page_template_stats))
+    cache_after = Etymology.make_uuid.cache_info()
+    stats["term_id_cache_hits"] += cache_after.hits - cache_before.hits
+    stats["term_id_cache_misses"] += cache_after.misses - cache_before.misses
+    shard = None
+    if shard_dir:
+        shard = write_shard(shard_dir, shard_codec, [row for _, _, rows, _ in results for row in rows],
+                            zstd_threads)
+        if not cache_path:
+            results = [(title, sha1, [], None) for title, sha1, _, _ in results]
+    return results, stats, batch_template_stats, shard
+
+
+def parse_wikitext(unparsed_data: Tuple[str, Optional[str]], lazy_sections: bool = False,
+                   fast_templates: bool = False,
+                   language_filter: Optional[Callable[[str], bool]] = None) -> List[Etymology]:
+    """
+    Extracts etymologies from every Etymology section of every language on a page. With `lazy_sections`,
+    only the Etymology sections are sliced out and parsed (falling back to a full parse for pages
+    the slicer can't handle), which yields the same sections as the full parse. `fast_templates` implies
+    `lazy_sections` and tokenizes the sliced sections with the template-only scanner in `tokenizer`.
+    A `language_filter` on level-2 header names also implies `lazy_sections`, so that the sections of
+    other languages are skipped before parsing.
+    """
+    term, unparsed_wikitext = unparsed_data[0], unparsed_data[1]
     parsed_etys = []
-    for language_section in wikitext.get_sections(levels=[2]):
-        lang = str(language_section.nodes[0].title)
-        etymologies = language_section.get_sections(matches="Etymology", flat=True)
-        for e in etymologies:
-            clean_wikicode(e)
-            for n in e.ifilter_templates(recursive=False):
-                name = str(n.name)
-                parsed = parse_template(name, term, lang, n)
-                parsed_etys.extend([e for e in parsed if e.is_valid()])
+    for lang, e in page_sections(unparsed_wikitext, lazy_sections, fast_templates, language_filter):
+        clean_wikicode(e)
+        for n in e.ifilter_templates(recursive=False):
+            name = str(n.name)
+            parsed = parse_template(name, term, lang, n)
+            parsed_etys.extend([e for e in parsed if e.is_valid()])
     return [e for e in parsed_etys if e.is_valid()]
 
 
+def page_sections(unparsed_wikitext: Optional[str], lazy_sections: bool = False, fast_templates: bool = False,
+                  language_filter: Optional[Callable[[str], bool]] = None) -> List[Tuple[str, Wikicode]]:
+    """
+    Returns (language, Etymology section) pairs for a page.
+    """
+    sections = None
+    if (lazy_sections or fast_templates or language_filter) and unparsed_wikitext:
+        sections = etymology_sections(unparsed_wikitext, fast_templates, language_filter)
+    if sections is None:
+        wikitext = mwp.parse(unparsed_wikitext)
+        sections = []
+        for language_section in wikitext.get_sections(levels=[2]):
+            lang = str(language_section.nodes[0].title)
+            if language_filter and not language_filter(lang):
+                continue
+            etymologies = language_section.get_sections(matches="Etymology", flat=True)
+            sections.extend((lang, e) for e in etymologies)
+    return sections
+
+
 def clean_wikicode(wc: Wikicode):
     """
     Performs operations on each etymology section that get rid of extraneous nodes
@@ -257,7 +698,85 @@ def inherited(t: Template) -> Generator[List[str], None, None]:
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extracts etymologies from the English Wiktionary dump.")
+    parser.add_argument("--multistream", action="store_true",
+                        help="Read the multistream dump and decompress its bz2 streams in parallel.")
+    parser.add_argument("--connections", type=int, default=1,
+                        help="Number of parallel ranged connections used to download the dump.")
+    parser.add_argument("--stream-download", action="store_true",
+                        help="Parse the dump while it downloads instead of waiting for the download to finish.")
+    parser.add_argument("--no-prefilter", action="store_true",
+                        help="Send every page to the workers, not just those with an Etymology heading.")
+    parser.add_argument("--lazy-sections", action="store_true",
+                        help="Parse only the sliced Etymology sections of each page instead of the whole page.")
+    parser.add_argument("--fast-templates", action="store_true",
+                        help="Tokenize sliced Etymology sections with the template-only scanner "
+                             "(implies --lazy-sections).")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="Target amount of wikitext (in characters) per batch of pages sent to a worker.")
+    parser.add_argument("--cache", type=Path, default=None,
+                        help="SQLite page cache; pages unchanged since the previous run reuse its rows.")
+    parser.add_argument("--template-report", type=Path, default=TEMPLATE_REPORT_PATH,
+                        help="Where to write the JSON report of per-template and per-parser statistics.")
+    parser.add_argument("--format", choices=("csv", "parquet", "normalized", "sqlite"), default="csv",
+                        help="Output format: gzipped CSV, Parquet (requires pyarrow), normalized gzipped CSV "
+                             "tables with integer keys or an indexed SQLite database.")
+    parser.add_argument("--checkpoint", type=Path, default=None,
+                        help="Save progress to this file periodically and resume from it if it exists.")
+    parser.add_argument("--checkpoint-interval", type=float, default=CHECKPOINT_INTERVAL,
+                        help="Seconds between checkpoints.")
+    parser.add_argument("--shards", choices=("gzip", "zstd"), default=None,
+                        help="Have every worker compress its own CSV shard (in shards/, with a manifest) "
+                             "instead of writing a single CSV file.")
+    parser.add_argument("--merge-shards", action="store_true",
+                        help="With --shards, also merge the shards into a single etymology.csv.gz.")
+    parser.add_argument("--zstd-threads", type=int, default=ZSTD_THREADS,
+                        help="With --shards zstd, compression threads per worker (0: compress in the worker "
+                             "itself, -1: one per CPU; every worker gets its own).")
+    parser.add_argument("--max-pages-in-flight", type=int, default=None,
+                        help="Stop reading the dump while this many pages are waiting for or being parsed.")
+    parser.add_argument("--max-chars-in-flight", type=int, default=None,
+                        help="Stop reading the dump while this many characters of wikitext are waiting for or being "
+                             "parsed (default: {} batches per CPU).".format(IN_FLIGHT_BATCHES))
+    parser.add_argument("--max-waiting-batches", type=int, default=None,
+                        help="Stop reading the dump while this many parsed batches are waiting to be written "
+                             "(default: {} per CPU).".format(WAITING_BATCHES))
+    parser.add_argument("--languages", nargs="+", default=None, metavar="LANGUAGE",
+                        help="Only extract these languages (Wiktionary codes or header names, e.g. en la ine-pro).")
+    parser.add_argument("--titles", type=Path, default=None,
+                        help="Only extract the pages whose titles are listed in this file, one per line.")
+    parser.add_argument("--title-regex", default=None,
+                        help="Only extract the pages whose titles match this regex (combined with --titles, "
+                             "pages matching either are extracted).")
+    parser.add_argument("--stats-file", type=Path, default=None,
+                        help="Append run statistics (throughput, queue depths, worker utilization, stalls, ETA) "
+                             "to this file as JSON lines.")
+    parser.add_argument("--stats-port", type=int, default=None,
+                        help="Serve the latest run statistics as JSON on this port of localhost.")
+    parser.add_argument("--stats-interval", type=float, default=TELEMETRY_INTERVAL,
+                        help="Seconds between two samples of the run statistics.")
+    parser.add_argument("--fts", action="store_true",
+                        help="With --format sqlite, also build a full-text index on terms.")
+    args = parser.parse_args()
+    if args.multistream and args.stream_download:
+        parser.error("--stream-download can't be combined with --multistream")
+
     logging.basicConfig(level="INFO")
-    download(WIKTIONARY_URL)
-    write_all()
-    print(dict(sorted(unparsed_templates.items(), key=lambda x: x[1], reverse=True)))
+    download_url = None
+    if args.multistream:
+        download(MULTISTREAM_INDEX_URL, MULTISTREAM_INDEX_PATH, checksums_url=SHA1SUMS_URL)
+        download(MULTISTREAM_URL, MULTISTREAM_PATH, connections=args.connections, checksums_url=SHA1SUMS_URL)
+    elif args.stream_download and not DOWNLOAD_PATH.exists():
+        download_url = WIKTIONARY_URL
+    else:
+        download(WIKTIONARY_URL, DOWNLOAD_PATH, connections=args.connections, checksums_url=SHA1SUMS_URL)
+    write_all(multistream=args.multistream, prefilter=None if args.no_prefilter else has_etymology_heading,
+              lazy_sections=args.lazy_sections, fast_templates=args.fast_templates, batch_size=args.batch_size,
+              output_format=args.format, fts=args.fts, cache_path=args.cache, download_url=download_url,
+              template_report_path=args.template_report, checkpoint_path=args.checkpoint,
+              checkpoint_interval=args.checkpoint_interval, shard_codec=args.shards, merge=args.merge_shards,
+              max_pages_in_flight=args.max_pages_in_flight, max_chars_in_flight=args.max_chars_in_flight,
+              max_waiting_batches=args.max_waiting_batches,
+              scope=Scope.create(args.languages, load_titles(args.titles) if args.titles else None, args.title_regex),
+              stats_path=args.stats_file, stats_port=args.stats_port, stats_interval=args.stats_interval,
+              zstd_threads=args.zstd_threads)
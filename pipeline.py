@@ -0,0 +1,136 @@
+import os
+import queue
+from collections import Counter
+from functools import partial
+from multiprocessing.pool import Pool
+from time import perf_counter
+from typing import Any, Callable, Dict, Generator, Iterable, Optional, Tuple
+
+# Finished results held for the consumer before no more tasks are submitted, unless told otherwise
+MAX_WAITING = 16
+
+
+def timed(func: Callable, task) -> Tuple[int, float, Any]:
+    """
+    Runs a task in a worker, returning the worker's pid and the time it spent on the task along with the result.
+    """
+    start = perf_counter()
+    result = func(task)
+    return os.getpid(), perf_counter() - start, result
+
+
+class BoundedPipeline:
+    """
+    Feeds tasks to a process pool and yields their results, like `Pool.imap_unordered` (or `Pool.imap` if
+    `ordered`), but with backpressure. `Pool.imap` reads its whole input as fast as it can, so when the workers
+    or the consumer fall behind, tasks and results pile up in memory. Here, the next task is only taken from
+    the input while the submitted, unfinished tasks add up to less than `max_items` items and `max_size`
+    (in whatever unit `measure` reports sizes in), and fewer than `max_waiting` finished results wait to be consumed.
+    Whatever its size, one task is always let through when nothing else is in flight.
+
+    The current and peak queue depths are kept as attributes, along with the number of tasks and items
+    submitted, the time each worker (by pid) spent running tasks, and the time spent waiting on workers:
+    in total (`wait_seconds`) and while more input was ready to be submitted (`stall_seconds`).
+    """
+    def __init__(self, pool: Pool, max_items: Optional[int] = None, max_size: Optional[int] = None,
+                 max_waiting: int = MAX_WAITING, ordered: bool = False):
+        self.pool = pool
+        self.max_items = max_items
+        self.max_size = max_size
+        self.max_waiting = max_waiting
+        self.ordered = ordered
+        self.done = queue.SimpleQueue()
+        self.in_flight: Dict[int, Tuple[int, int]] = {}
+        self.waiting: Dict[int, Tuple[bool, Any]] = {}
+        self.submitted = 0
+        self.next_result = 0
+        self.items = 0
+        self.size = 0
+        self.submitted_items = 0
+        self.peaks = Counter()
+        self.busy_seconds = Counter()
+        self.wait_seconds = 0.0
+        self.stall_seconds = 0.0
+
+    def has_room(self) -> bool:
+        if len(self.waiting) >= self.max_waiting:
+            return False
+        if not self.in_flight:
+            return True
+        return ((self.max_items is None or self.items < self.max_items)
+                and (self.max_size is None or self.size < self.max_size))
+
+    def submit(self, func: Callable, task, items: int, size: int) -> None:
+        seq = self.submitted
+        self.submitted += 1
+        self.in_flight[seq] = (items, size)
+        self.items += items
+        self.size += size
+        self.submitted_items += items
+        self.pool.apply_async(timed, (func, task), callback=partial(self.finish, seq, True),
+                              error_callback=partial(self.finish, seq, False))
+        self.peaks["items"] = max(self.peaks["items"], self.items)
+        self.peaks["size"] = max(self.peaks["size"], self.size)
+
+    def finish(self, seq: int, success: bool, value) -> None:
+        """
+        Runs in the pool's result handler thread; everything else happens in the consuming thread.
+        """
+        if success:
+            pid, seconds, value = value
+            self.busy_seconds[pid] += seconds
+        self.done.put((seq, success, value))
+
+    def collect(self, block: bool) -> None:
+        """
+        Moves finished tasks from in flight to waiting, first waiting for one if `block`.
+        """
+        while True:
+            try:
+                seq, success, value = self.done.get(block=block)
+            except queue.Empty:
+                return
+            block = False
+            items, size = self.in_flight.pop(seq)
+            self.items -= items
+            self.size -= size
+            self.waiting[seq] = (success, value)
+            self.peaks["waiting"] = max(self.peaks["waiting"], len(self.waiting))
+
+    def ready(self) -> Optional[int]:
+        if self.ordered:
+            return self.next_result if self.next_result in self.waiting else None
+        return min(self.waiting, default=None)
+
+    def imap(self, func: Callable, tasks: Iterable,
+             measure: Callable[[Any], Tuple[int, int]]) -> Generator[Any, None, None]:
+        """
+        Yields `func(task)` for every task. `measure` gives the (items, size) a task counts for while in flight.
+        A task's exception is raised here, when its result would have been yielded.
+        """
+        tasks = iter(tasks)
+        exhausted = False
+        while True:
+            self.collect(block=False)
+            while not exhausted and self.has_room():
+                task = next(tasks, None)
+                if task is None:
+                    exhausted = True
+                else:
+                    self.submit(func, task, *measure(task))
+            seq = self.ready()
+            if seq is None:
+                if not self.in_flight:
+                    return
+                start = perf_counter()
+                self.collect(block=True)
+                waited = perf_counter() - start
+                self.wait_seconds += waited
+                if not exhausted:
+                    self.stall_seconds += waited
+                continue
+            success, value = self.waiting.pop(seq)
+            self.next_result += 1
+            if not success:
+                raise value
+            yield value
@@ -0,0 +1,73 @@
+import hashlib
+import logging
+import re
+from pathlib import Path
+from typing import Dict, FrozenSet, Iterable, NamedTuple, Optional, Pattern
+
+from elements import lang_dict
+
+
+class Scope(NamedTuple):
+    """
+    Restricts a run to some languages and/or pages. `languages` are level-2 header names, `titles` exact page
+    titles and `title_pattern` a regex searched in page titles; a page is in scope if it matches either title
+    filter (when any is given) and has a section for one of the languages (when given).
+
+    Titles and a raw-text search for the language headers are checked in the producer, so out-of-scope pages are
+    never sent to a worker; in the worker, the sections of other languages are dropped before being parsed.
+    """
+    languages: Optional[FrozenSet[str]] = None
+    titles: Optional[FrozenSet[str]] = None
+    title_pattern: Optional[Pattern] = None
+    # Superset of the level-2 headers of `languages`, for the producer
+    language_heading: Optional[Pattern] = None
+
+    @classmethod
+    def create(cls, languages: Optional[Iterable[str]] = None, titles: Optional[Iterable[str]] = None,
+               title_regex: Optional[str] = None) -> Optional["Scope"]:
+        """
+        Languages may be given as Wiktionary codes or header names. Returns None if nothing is restricted.
+        """
+        if not languages and titles is None and not title_regex:
+            return None
+        names = frozenset(resolve_language(language) for language in languages) if languages else None
+        return cls(languages=names, titles=frozenset(titles) if titles is not None else None,
+                   title_pattern=re.compile(title_regex) if title_regex else None,
+                   language_heading=re.compile(r"^==\s*(?:{})\s*==".format(
+                       "|".join(re.escape(name) for name in sorted(names))), re.MULTILINE) if names else None)
+
+    def title_in_scope(self, title: str) -> bool:
+        if self.titles is None and self.title_pattern is None:
+            return True
+        return ((self.titles is not None and title in self.titles)
+                or (self.title_pattern is not None and self.title_pattern.search(title) is not None))
+
+    def text_in_scope(self, text: Optional[str]) -> bool:
+        return self.language_heading is None or (bool(text) and self.language_heading.search(text) is not None)
+
+    def language_in_scope(self, lang: str) -> bool:
+        return self.languages is None or lang.strip() in self.languages
+
+    def config(self) -> Dict:
+        return {"languages": sorted(self.languages) if self.languages is not None else None,
+                "titles": hashlib.sha1("\n".join(sorted(self.titles)).encode("utf-8")).hexdigest()
+                if self.titles is not None else None,
+                "title_regex": self.title_pattern.pattern if self.title_pattern else None}
+
+
+def resolve_language(language: str) -> str:
+    codes = lang_dict()
+    if language in codes:
+        return codes[language]
+    if language not in codes.values():
+        logging.warning("`{}` isn't a known language code or name, matching headers against it as is".format(
+            language))
+    return language
+
+
+def load_titles(path: Path) -> FrozenSet[str]:
+    """
+    Reads a list of page titles, one per line.
+    """
+    with open(path, encoding="utf-8") as f_in:
+        return frozenset(line.strip() for line in f_in if line.strip())
@@ -0,0 +1,356 @@
+"""
+Prefix and fuzzy search over every term (and related term) in the output of `main.write_all`.
+
+`build_index` writes a directory of flat binary arrays: the distinct (lang, term) pairs sorted by their
+case-folded spelling, for prefix queries by binary search, and posting lists (sorted keys with offsets into one
+array of term ids) for fuzzy queries, each kept once for all languages and once per language. Candidates for a
+fuzzy query are the terms sharing enough bigrams with it (with lists split by term length), or, for queries too
+short for bigrams to rule anything out, the terms sharing a deletion variant with it (the strings left by
+deleting up to `DELETION_DISTANCE` characters, indexed for short terms). Candidates are then checked by edit
+distance. A query that would read more than `MAX_FUZZY_POSTINGS` postings or check more than
+`MAX_FUZZY_CANDIDATES` candidates is refused with `QueryTooBroad` instead, so that every query answered takes a
+few milliseconds. Everything is memory-mapped, so an index opens instantly.
+
+    python search.py build
+    python search.py prefix proto- --lang en
+    python search.py fuzzy amicvs --lang la --distance 2
+"""
+import argparse
+import csv
+import gzip
+import json
+import logging
+import sys
+import time
+from array import array
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from elements import lang_dict
+from store import MappedDirectory
+
+ETYMOLOGY_PATH = Path.cwd().joinpath("etymology.csv.gz")
+SEARCH_PATH = Path.cwd().joinpath("terms.search")
+# Length of the n-grams in the fuzzy index: bigrams still filter short queries with two edits
+NGRAM_SIZE = 2
+# Edits covered by the deletion variants of short terms, and the length of the longest term they're kept for:
+# enough for every query with up to that many edits that is too short for its bigrams to filter anything
+DELETION_DISTANCE = 2
+DELETION_MAX_LENGTH = 3 * DELETION_DISTANCE - 1
+# Work a fuzzy query may take, as postings counted and candidates compared, each worth a few milliseconds
+MAX_FUZZY_POSTINGS = 30_000
+MAX_FUZZY_CANDIDATES = 600
+# Bumped whenever the layout of the index changes
+INDEX_VERSION = 2
+
+
+class QueryTooBroad(ValueError):
+    """
+    Raised for a fuzzy query matching too large a part of the index to be answered quickly, which a language
+    filter or fewer edits would narrow down.
+    """
+
+
+def search_key(term: str) -> str:
+    return term.casefold()
+
+
+def posting_key(scope: str, length: int, ngram: str = "") -> str:
+    """
+    Posting lists are split by the length of the term, so that a fuzzy query only reads the lists of terms
+    whose length is within its edit distance, and by language: `scope` is "" for the lists of all languages, or
+    a language's number for its own. The list for `ngram` "" holds every term of that length.
+    """
+    return "{}:{}:{}".format(scope, length, ngram)
+
+
+def deletion_key(scope: str, variant: str) -> str:
+    return "{}:~{}".format(scope, variant)
+
+
+def ngrams(key: str) -> List[str]:
+    padded = "$" + key + "$"
+    return sorted({padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)})
+
+
+def deletions(key: str, distance: int) -> Set[str]:
+    """
+    The strings left by deleting up to `distance` characters from `key`. Two strings within `distance` edits of
+    each other always have one in common.
+    """
+    variants = frontier = {key}
+    for _ in range(distance):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier for i in range(len(variant))}
+        variants = variants | frontier
+    return variants
+
+
+def char_masks(key: str) -> Dict[str, int]:
+    """
+    Bit masks of the positions of every character of `key`, for `edit_distance`.
+    """
+    masks: Dict[str, int] = {}
+    for i, char in enumerate(key):
+        masks[char] = masks.get(char, 0) | 1 << i
+    return masks
+
+
+def edit_distance(key: str, masks: Dict[str, int], other: str) -> int:
+    """
+    Levenshtein distance between `key` (along with its `char_masks`) and `other`, by Myers' bit-parallel
+    algorithm: the column of the distance table for each character of `other` is computed at once, as bit vectors
+    of its vertical deltas.
+    """
+    if not key:
+        return len(other)
+    full = (1 << len(key)) - 1
+    last = 1 << (len(key) - 1)
+    positive, negative, distance = full, 0, len(key)
+    for char in other:
+        matches = masks.get(char, 0)
+        vertical = matches | negative
+        horizontal = (((matches & positive) + positive) ^ positive) | matches
+        horizontal_positive = negative | ~(horizontal | positive)
+        horizontal_negative = positive & horizontal
+        if horizontal_positive & last:
+            distance += 1
+        elif horizontal_negative & last:
+            distance -= 1
+        horizontal_positive = (horizontal_positive << 1) | 1
+        positive = ((horizontal_negative << 1) | ~(vertical | horizontal_positive)) & full
+        negative = horizontal_positive & vertical & full
+    return distance
+
+
+def write_strings(directory: Path, name: str, values: Iterable[str]) -> None:
+    offsets = array("q", [0])
+    with open(directory.joinpath(name + ".data"), "wb") as f_out:
+        for value in values:
+            encoded = value.encode("utf-8")
+            f_out.write(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+    with open(directory.joinpath(name + ".offsets"), "wb") as f_out:
+        offsets.tofile(f_out)
+
+
+def build_index(csv_path: Path = ETYMOLOGY_PATH, directory: Path = SEARCH_PATH) -> int:
+    """
+    Indexes the distinct (lang, term) pairs of `csv_path`, terms and related terms alike. Returns their number.
+    """
+    start = time.perf_counter()
+    terms = set()
+    with gzip.open(csv_path, "rt") as f_in:
+        reader = csv.reader(f_in)
+        next(reader)
+        for row in reader:
+            terms.add((row[1], row[2]))
+            if row[6]:
+                terms.add((row[5], row[6]))
+    entries = sorted((search_key(term), lang, term) for lang, term in terms)
+    del terms
+    languages: Dict[str, int] = {}
+    langs = array("h", (languages.setdefault(lang, len(languages)) for _, lang, _ in entries))
+    scope_terms = defaultdict(lambda: array("i"))
+    for term_id, code in enumerate(langs):
+        scope_terms[str(code)].append(term_id)
+    scope_terms[""] = array("i", range(len(entries)))
+
+    directory.mkdir(parents=True, exist_ok=True)
+    write_strings(directory, "keys", (key for key, _, _ in entries))
+    write_strings(directory, "terms", (term for _, _, term in entries))
+    with open(directory.joinpath("langs.int16"), "wb") as f_out:
+        langs.tofile(f_out)
+    key_offsets = array("q", [0])
+    posting_offsets = array("q", [0])
+    with open(directory.joinpath("posting_keys.data"), "wb") as keys_out, \
+            open(directory.joinpath("postings.int32"), "wb") as postings_out:
+        # One scope's lists at a time: its keys all start with the scope and a colon, so the scopes sorted
+        # that way add up to the sorted list of all keys
+        for scope in sorted(scope_terms, key=lambda scope: scope + ":"):
+            postings = scope_postings(entries, scope, scope_terms.pop(scope))
+            for key in sorted(postings):
+                encoded = key.encode("utf-8")
+                keys_out.write(encoded)
+                key_offsets.append(key_offsets[-1] + len(encoded))
+                postings[key].tofile(postings_out)
+                posting_offsets.append(posting_offsets[-1] + len(postings[key]))
+    for name, offsets in (("posting_keys.offsets", key_offsets), ("postings.offsets", posting_offsets)):
+        with open(directory.joinpath(name), "wb") as f_out:
+            offsets.tofile(f_out)
+    with open(directory.joinpath("meta.json"), "w") as f_out:
+        json.dump({"version": INDEX_VERSION, "terms": len(entries), "languages": list(languages),
+                   "deletion_distance": DELETION_DISTANCE, "deletion_max_length": DELETION_MAX_LENGTH},
+                  f_out, ensure_ascii=False)
+    logging.info("Indexed {} terms into {} posting lists in {:.1f}s".format(
+        len(entries), len(key_offsets) - 1, time.perf_counter() - start))
+    return len(entries)
+
+
+def scope_postings(entries: List[Tuple[str, str, str]], scope: str, term_ids: Iterable[int]) -> Dict[str, array]:
+    """
+    The posting lists of one scope (see `posting_key`) for the given entries.
+    """
+    postings = defaultdict(lambda: array("i"))
+    for term_id in term_ids:
+        key = entries[term_id][0]
+        postings[posting_key(scope, len(key))].append(term_id)
+        for ngram in ngrams(key):
+            postings[posting_key(scope, len(key), ngram)].append(term_id)
+        if len(key) <= DELETION_MAX_LENGTH:
+            for variant in deletions(key, DELETION_DISTANCE):
+                postings[deletion_key(scope, variant)].append(term_id)
+    return postings
+
+
+class SearchIndex(MappedDirectory):
+    """
+    Read-only, memory-mapped term search index. Language filters accept a Wiktionary code or a language name.
+    """
+    def __init__(self, directory: Path = SEARCH_PATH):
+        super().__init__(directory)
+        self.size: int = self.meta["terms"]
+        self.languages: List[str] = self.meta["languages"]
+        self.language_codes = {name: code for code, name in enumerate(self.languages)}
+        if self.meta.get("version") != INDEX_VERSION:
+            raise ValueError("The search index in {} was built by an older version, rebuild it".format(directory))
+        self.deletion_distance: int = self.meta["deletion_distance"]
+        self.deletion_max_length: int = self.meta["deletion_max_length"]
+
+    def string(self, name: str, i: int) -> str:
+        offsets = self.view(name + ".offsets", "q")
+        return str(self.view(name + ".data", "B")[offsets[i]:offsets[i + 1]], "utf-8")
+
+    def lang_code(self, lang: Optional[str]) -> Optional[int]:
+        if lang is None:
+            return None
+        return self.language_codes.get(lang_dict().get(lang, lang), -1)
+
+    def entry(self, i: int) -> Tuple[str, str]:
+        return self.languages[self.view("langs.int16", "h")[i]], self.string("terms", i)
+
+    def lower_bound(self, name: str, count: int, target: str) -> int:
+        offsets = self.view(name + ".offsets", "q")
+        data = self.view(name + ".data", "B")
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if str(data[offsets[mid]:offsets[mid + 1]], "utf-8") < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def prefix(self, prefix: str, lang: Optional[str] = None, limit: int = 50) -> List[Tuple[str, str]]:
+        """
+        (lang, term) pairs whose term starts with `prefix` (ignoring case), in alphabetical order.
+        """
+        key = search_key(prefix)
+        code = self.lang_code(lang)
+        langs = self.view("langs.int16", "h")
+        found = []
+        i = self.lower_bound("keys", self.size, key)
+        while i < self.size and len(found) < limit and self.string("keys", i).startswith(key):
+            if code is None or langs[i] == code:
+                found.append(self.entry(i))
+            i += 1
+        return found
+
+    def postings(self, key: str) -> memoryview:
+        count = len(self.view("postings.offsets", "q")) - 1
+        i = self.lower_bound("posting_keys", count, key)
+        if i == count or self.string("posting_keys", i) != key:
+            return memoryview(b"").cast("i")
+        offsets = self.view("postings.offsets", "q")
+        return self.view("postings.int32", "i")[offsets[i]:offsets[i + 1]]
+
+    def fuzzy(self, query: str, lang: Optional[str] = None, max_distance: int = 2,
+              limit: int = 20) -> List[Tuple[int, str, str]]:
+        """
+        (edit distance, lang, term) for the terms within `max_distance` edits of `query` (ignoring case),
+        closest first. Only the posting lists of `lang` (if given) are read.
+
+        When every match is short enough to have its deletion variants indexed, the candidates are the terms
+        sharing one with the query. Otherwise, as an edit changes at most `NGRAM_SIZE` of a term's n-grams, a match
+        of a given length shares all but `NGRAM_SIZE * max_distance` of the query's n-grams: only terms of lengths
+        within `max_distance` of the query's are counted, and only those with enough n-grams in common are compared.
+        Raises `QueryTooBroad` rather than reading more than `MAX_FUZZY_POSTINGS` postings or comparing more than
+        `MAX_FUZZY_CANDIDATES` candidates.
+        """
+        key = search_key(query)
+        code = self.lang_code(lang)
+        scope = "" if code is None else str(code)
+        lengths = range(max(len(key) - max_distance, 0), len(key) + max_distance + 1)
+        query_ngrams = ngrams(key)
+        threshold = len(query_ngrams) - NGRAM_SIZE * max_distance
+        if max_distance <= self.deletion_distance and len(key) + max_distance <= self.deletion_max_length:
+            lists = [self.postings(deletion_key(scope, variant)) for variant in deletions(key, max_distance)]
+            threshold = 1
+        elif threshold <= 0:
+            # Too short for the n-gram filter to rule anything out (only for queries of repeated n-grams)
+            lists = [self.postings(posting_key(scope, length)) for length in lengths]
+            threshold = 1
+        else:
+            # A term is only in the lists of its own length, so those of all lengths can be counted together
+            lists = [self.postings(posting_key(scope, length, ngram)) for length in lengths for ngram in query_ngrams]
+        if sum(len(postings) for postings in lists) > MAX_FUZZY_POSTINGS:
+            raise QueryTooBroad("Too many terms share n-grams with `{}` to search them quickly, filter by language "
+                                "or allow fewer edits".format(query))
+        counts = Counter()
+        for postings in lists:
+            counts.update(postings)
+        candidates = [i for i, count in counts.items() if count >= threshold]
+        if len(candidates) > MAX_FUZZY_CANDIDATES:
+            raise QueryTooBroad("Too many terms are candidates for `{}` to search them quickly, filter by language "
+                                "or allow fewer edits".format(query))
+        offsets = self.view("keys.offsets", "q")
+        data = self.view("keys.data", "B")
+        masks = char_masks(key)
+        found = []
+        for i in candidates:
+            candidate = str(data[offsets[i]:offsets[i + 1]], "utf-8")
+            if abs(len(candidate) - len(key)) <= max_distance:
+                distance = edit_distance(key, masks, candidate)
+                if distance <= max_distance:
+                    found.append((distance, *self.entry(i)))
+        return sorted(found, key=lambda match: (match[0], match[2], match[1]))[:limit]
+
+
+def main_cli(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build and query the term search index.")
+    parser.add_argument("--index", type=Path, default=SEARCH_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="Index the terms of the CSV output.")
+    build_parser.add_argument("--input", type=Path, default=ETYMOLOGY_PATH)
+    prefix_parser = commands.add_parser("prefix", help="Terms starting with a prefix.")
+    prefix_parser.add_argument("query")
+    fuzzy_parser = commands.add_parser("fuzzy", help="Terms within a few edits of the query.")
+    fuzzy_parser.add_argument("query")
+    fuzzy_parser.add_argument("--distance", type=int, default=2)
+    for command in (prefix_parser, fuzzy_parser):
+        command.add_argument("--lang", default=None, help="Language code or name.")
+        command.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level="INFO")
+    if args.command == "build":
+        build_index(args.input, args.index)
+        return 0
+    start = time.perf_counter()
+    with SearchIndex(args.index) as index:
+        if args.command == "prefix":
+            found = [(None, lang, term) for lang, term in index.prefix(args.query, args.lang, args.limit)]
+        else:
+            try:
+                found = index.fuzzy(args.query, args.lang, args.distance, args.limit)
+            except QueryTooBroad as e:
+                logging.error(e)
+                return 2
+        for distance, lang, term in found:
+            print("\t".join(([str(distance)] if distance is not None else []) + [lang, term]))
+    logging.info("{} terms in {:.1f} ms".format(len(found), (time.perf_counter() - start) * 1000))
+    return 0 if found else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
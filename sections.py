@@ -0,0 +1,142 @@
+import re
+from typing import Callable, List, Optional, Tuple
+
+import mwparserfromhell as mwp
+from mwparserfromhell.nodes.heading import Heading
+from mwparserfromhell.wikicode import Wikicode
+
+from tokenizer import scan_section
+
+# Every line that mwparserfromhell could possibly turn into a heading
+HEADING_CANDIDATE = re.compile(r"^=.*$", re.MULTILINE)
+# Constructs that can contain a heading line without it becoming a top-level section
+NESTING_TOKEN = re.compile(r"\{\{|\}\}|\[\[|\]\]|^\{\||^\|\}|<!--|<(/?)([a-zA-Z][\w:-]*)[^<>]*?(/?)>", re.MULTILINE)
+VOID_TAGS = {"br", "hr", "wbr", "img"}
+# Same pattern and flags that `parse_wikitext` uses with `get_sections(matches=...)`
+ETYMOLOGY_MATCH = "Etymology"
+ETYMOLOGY_FLAGS = re.IGNORECASE | re.DOTALL | re.UNICODE
+
+
+def nesting_depths(wikitext: str, offsets: List[int]) -> List[int]:
+    """
+    Returns, for each offset, how many templates/links/tables/tags/comments are still open at that point.
+    Closing tokens without a matching opener are treated as plain text, like the parser does.
+    """
+    depths = []
+    open_counts = {}
+    offsets = iter(offsets)
+    next_offset = next(offsets, None)
+    pos = 0
+    while next_offset is not None:
+        m = NESTING_TOKEN.search(wikitext, pos)
+        while next_offset is not None and (m is None or m.start() >= next_offset):
+            depths.append(sum(open_counts.values()))
+            next_offset = next(offsets, None)
+        if m is None:
+            break
+        token = m.group(0)
+        pos = m.end()
+        if token == "<!--":
+            end = wikitext.find("-->", pos)
+            pos = len(wikitext) if end == -1 else end + 3
+        while next_offset is not None and next_offset < pos:
+            # Offset falls inside the token itself (e.g. a multi-line comment)
+            depths.append(1)
+            next_offset = next(offsets, None)
+        if token == "<!--":
+            continue
+        if token.startswith("<"):
+            name = m.group(2).lower()
+            if m.group(3) or name in VOID_TAGS:
+                continue
+            key, closing = "<" + name, bool(m.group(1))
+        else:
+            key, closing = {"}}": ("{{", True), "]]": ("[[", True), "|}": ("{|", True)}.get(token, (token, False))
+        if closing:
+            if open_counts.get(key):
+                open_counts[key] -= 1
+        else:
+            open_counts[key] = open_counts.get(key, 0) + 1
+    return depths
+
+
+def scan_headings(wikitext: str) -> Optional[List[Tuple[int, Heading]]]:
+    """
+    Finds the top-level headings of a page with a line scan, parsing only the heading lines themselves.
+    Returns (offset, heading) pairs, or None if the page contains anything that could make the scan
+    disagree with a full parse (headings nested in templates/tags/comments, trailing markup on heading lines).
+    """
+    candidates = [(m.start(), m.group(0)) for m in HEADING_CANDIDATE.finditer(wikitext)]
+    if any(nesting_depths(wikitext, [start for start, _ in candidates])):
+        return None
+    headings = []
+    for start, line in candidates:
+        nodes = mwp.parse(line.rstrip()).nodes
+        if len(nodes) != 1 or not isinstance(nodes[0], Heading):
+            return None
+        headings.append((start, nodes[0]))
+    return headings
+
+
+def slice_etymologies(wikitext: str) -> Optional[List[Tuple[str, List[str]]]]:
+    """
+    Splits a page into its level-2 language sections and returns, for each language, the raw text of its
+    flat Etymology sections -- the same spans `get_sections(levels=[2])` and
+    `get_sections(matches="Etymology", flat=True)` select on the full parse.
+    Languages without an Etymology section are omitted. Returns None if the page can't be sliced safely.
+    """
+    headings = scan_headings(wikitext)
+    if headings is None:
+        return None
+    ends = [start for start, _ in headings[1:]] + [len(wikitext)]
+    languages = []
+    for i, (start, heading) in enumerate(headings):
+        if heading.level != 2:
+            continue
+        etymologies = []
+        for j in range(i, len(headings)):
+            sub_start, sub_heading = headings[j]
+            if j > i and sub_heading.level <= 2:
+                break
+            if re.search(ETYMOLOGY_MATCH, str(sub_heading.title), ETYMOLOGY_FLAGS):
+                etymologies.append(wikitext[sub_start:ends[j]])
+        if etymologies:
+            languages.append((str(heading.title), etymologies))
+    return languages
+
+
+def parse_slice(section: str) -> Optional[Wikicode]:
+    """
+    Parses a single sliced section, returning None if the result doesn't consist of exactly one
+    leading top-level heading (i.e. the slice doesn't stand on its own).
+    """
+    wc = mwp.parse(section)
+    headings = wc.filter_headings(recursive=False)
+    if len(headings) != 1 or wc.nodes[0] is not headings[0]:
+        return None
+    return wc
+
+
+def etymology_sections(wikitext: str, fast_templates: bool = False,
+                       language_filter: Optional[Callable[[str], bool]] = None) -> Optional[List[Tuple[str, Wikicode]]]:
+    """
+    Returns (language, parsed Etymology section) pairs for a page, running mwparserfromhell only on the
+    sliced Etymology sections. Returns None if the page has to be parsed as a whole instead.
+    With `fast_templates`, sections are tokenized by `scan_section`, falling back to mwparserfromhell
+    for sections it can't handle. Sections of languages rejected by `language_filter` aren't parsed at all.
+    """
+    languages = slice_etymologies(wikitext)
+    if languages is None:
+        return None
+    sections = []
+    for lang, slices in languages:
+        if language_filter and not language_filter(lang):
+            continue
+        for section in slices:
+            wc = scan_section(section) if fast_templates else None
+            if wc is None:
+                wc = parse_slice(section)
+            if wc is None:
+                return None
+            sections.append((lang, wc))
+    return sections
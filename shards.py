@@ -0,0 +1,105 @@
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+from collections import Counter
+from pathlib import Path
+from typing import Generator, Sequence, TextIO, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from elements import Etymology, Row
+
+SHARD_SUFFIXES = {"gzip": ".csv.gz", "zstd": ".csv.zst"}
+MANIFEST_NAME = "manifest.json"
+# Compression threads per zstd shard writer, unless told otherwise (0: compress in the writing process itself)
+ZSTD_THREADS = 0
+ZSTD_LEVEL = 3
+
+
+def shard_stream(path: Path, codec: str, mode: str, zstd_threads: int = ZSTD_THREADS) -> TextIO:
+    """
+    Opens a shard for appending one more gzip member / zstd frame ("a"), or for reading all of them ("r").
+    A zstd frame is compressed with `zstd_threads` threads (-1: one per CPU).
+    """
+    if codec == "gzip":
+        return gzip.open(path, mode + "t")
+    if zstandard is None:
+        raise ImportError("zstd shards require zstandard (`pip install zstandard`)")
+    if mode == "a":
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=zstd_threads)
+        return io.TextIOWrapper(compressor.stream_writer(open(path, "ab")), encoding="utf-8")
+    return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True),
+                            encoding="utf-8")
+
+
+def write_shard(directory: Path, codec: str, rows: Sequence[Row], zstd_threads: int = ZSTD_THREADS) -> Tuple[str, int]:
+    """
+    Appends rows to the calling process's shard as a self-contained member, so that shards are valid files
+    after every batch without the process having to be told when the run ends. Returns the shard's name and
+    the number of rows written.
+    """
+    path = directory.joinpath("etymology-{}{}".format(os.getpid(), SHARD_SUFFIXES[codec]))
+    new = not path.exists()
+    with shard_stream(path, codec, "a", zstd_threads) as f_out:
+        writer = csv.writer(f_out)
+        if new:
+            writer.writerow(Etymology.header())
+        writer.writerows(rows)
+    return path.name, len(rows)
+
+
+def clear_shards(directory: Path) -> None:
+    directory.mkdir(parents=True, exist_ok=True)
+    for suffix in SHARD_SUFFIXES.values():
+        for path in directory.glob("etymology-*" + suffix):
+            path.unlink()
+    manifest = directory.joinpath(MANIFEST_NAME)
+    if manifest.exists():
+        manifest.unlink()
+
+
+def write_manifest(directory: Path, codec: str, shard_rows: Counter) -> None:
+    manifest = {"codec": codec, "columns": list(Etymology.header()), "rows": sum(shard_rows.values()),
+                "shards": [{"path": name, "rows": rows} for name, rows in sorted(shard_rows.items())]}
+    with open(directory.joinpath(MANIFEST_NAME), "w") as f_out:
+        json.dump(manifest, f_out, indent=2)
+    logging.info("Wrote {} rows to {} shards in {}".format(manifest["rows"], len(shard_rows), directory))
+
+
+def read_shards(directory: Path) -> Generator[list, None, None]:
+    """
+    Yields the rows of every shard listed in the manifest, checking each shard's row count.
+    """
+    with open(directory.joinpath(MANIFEST_NAME)) as f_in:
+        manifest = json.load(f_in)
+    for shard in manifest["shards"]:
+        rows = 0
+        with shard_stream(directory.joinpath(shard["path"]), manifest["codec"], "r") as f_in:
+            reader = csv.reader(f_in)
+            next(reader)
+            for row in reader:
+                rows += 1
+                yield row
+        if rows != shard["rows"]:
+            raise ValueError("Shard {} has {} rows, the manifest lists {}".format(shard["path"], rows, shard["rows"]))
+
+
+def merge_shards(directory: Path, path: Path) -> int:
+    """
+    Concatenates the shards listed in the manifest into a single gzipped CSV like the one `CsvWriter` writes.
+    """
+    rows = 0
+    with gzip.open(path, "wt") as f_out:
+        writer = csv.writer(f_out)
+        writer.writerow(Etymology.header())
+        for row in read_shards(directory):
+            writer.writerow(row)
+            rows += 1
+    logging.info("Merged {} rows into {}".format(rows, path))
+    return rows
@@ -0,0 +1,252 @@
+"""
+Memory-mapped columnar copy of the output of `main.write_all`, for lookups that don't have to read the whole
+dataset first.
+
+`compile_store` converts etymology.csv.gz into a directory of flat binary columns: string columns are a UTF-8
+data file plus an int64 offsets file, small-vocabulary columns are int16 codes into a vocabulary kept in
+meta.json, and positions are int32. Two int32 permutations of the row ids, sorted by (term, lang) and by
+(related_term, related_lang), are binary-searched at lookup time, touching only the pages they need.
+
+    python store.py compile
+    python store.py lookup wolf --lang English
+    python store.py related lupus --lang Latin
+"""
+import argparse
+import csv
+import gzip
+import json
+import logging
+import mmap
+import sys
+import time
+from array import array
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Sequence, Tuple
+
+from elements import Etymology, Row
+
+ETYMOLOGY_PATH = Path.cwd().joinpath("etymology.csv.gz")
+STORE_PATH = Path.cwd().joinpath("etymology.store")
+DICTIONARY_COLUMNS = ("lang", "reltype", "related_lang")
+INT_COLUMNS = ("position", "parent_position")
+# Values buffered per column before they're appended to its file
+FLUSH_SIZE = 64 * 1024
+NULL_INT = -1
+
+
+class ColumnWriter:
+    """
+    Appends values to one column's files, holding at most `FLUSH_SIZE` of them in memory.
+    """
+    def __init__(self, directory: Path, name: str, vocabulary: Optional[Dict[str, int]] = None):
+        self.name = name
+        self.vocabulary = vocabulary
+        self.f_data = None
+        if name in INT_COLUMNS:
+            self.values = array("i")
+            self.f_values = open(directory.joinpath(name + ".int32"), "wb")
+        elif vocabulary is not None:
+            self.values = array("h")
+            self.f_values = open(directory.joinpath(name + ".int16"), "wb")
+        else:
+            self.values = array("q", [0])
+            self.f_values = open(directory.joinpath(name + ".offsets"), "wb")
+            self.f_data = open(directory.joinpath(name + ".data"), "wb")
+            self.data = bytearray()
+            self.end = 0
+
+    def append(self, value: str) -> None:
+        if self.name in INT_COLUMNS:
+            self.values.append(int(value) if value else NULL_INT)
+        elif self.vocabulary is not None:
+            self.values.append(self.vocabulary.setdefault(value, len(self.vocabulary)))
+        else:
+            encoded = value.encode("utf-8")
+            self.data += encoded
+            self.end += len(encoded)
+            self.values.append(self.end)
+        if len(self.values) >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        self.values.tofile(self.f_values)
+        del self.values[:]
+        if self.f_data is not None:
+            self.f_data.write(self.data)
+            self.data = bytearray()
+
+    def close(self) -> None:
+        self.flush()
+        self.f_values.close()
+        if self.f_data is not None:
+            self.f_data.close()
+
+
+def compile_store(csv_path: Path = ETYMOLOGY_PATH, directory: Path = STORE_PATH) -> int:
+    """
+    Writes the columns of `csv_path` to `directory`, then the sorted lookup indexes. Returns the number of rows.
+    """
+    start = time.perf_counter()
+    directory.mkdir(parents=True, exist_ok=True)
+    vocabularies: Dict[str, Dict[str, int]] = {name: {} for name in DICTIONARY_COLUMNS}
+    with gzip.open(csv_path, "rt") as f_in:
+        reader = csv.reader(f_in)
+        header = next(reader)
+        columns = [ColumnWriter(directory, name, vocabularies.get(name)) for name in header]
+        rows = 0
+        for row in reader:
+            for column, value in zip(columns, row):
+                column.append(value)
+            rows += 1
+        for column in columns:
+            column.close()
+    with open(directory.joinpath("meta.json"), "w") as f_out:
+        json.dump({"rows": rows, "columns": header,
+                   "vocabularies": {name: list(vocabulary) for name, vocabulary in vocabularies.items()}},
+                  f_out, ensure_ascii=False)
+
+    store = EtymologyStore(directory)
+    for index_name, key_columns in EtymologyStore.INDEXES.items():
+        order = array("i", sorted(range(rows), key=lambda row: store.key(row, key_columns)))
+        with open(directory.joinpath(index_name + ".int32"), "wb") as f_out:
+            order.tofile(f_out)
+    store.close()
+    logging.info("Compiled {} rows into {} in {:.1f}s".format(rows, directory, time.perf_counter() - start))
+    return rows
+
+
+def open_mmap(path: Path) -> Tuple[BinaryIO, mmap.mmap]:
+    f_in = open(path, "rb")
+    if path.stat().st_size == 0:
+        return f_in, None
+    return f_in, mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class MappedDirectory:
+    """
+    A directory of flat binary arrays described by its meta.json. Files are memory-mapped on first use,
+    so a query only reads the pages it touches.
+    """
+    def __init__(self, directory: Path):
+        self.directory = directory
+        with open(directory.joinpath("meta.json")) as f_in:
+            self.meta = json.load(f_in)
+        self.files: List[BinaryIO] = []
+        self.mapped: Dict[str, memoryview] = {}
+
+    def view(self, filename: str, fmt: str) -> memoryview:
+        if filename not in self.mapped:
+            f_in, mm = open_mmap(self.directory.joinpath(filename))
+            self.files.append(f_in)
+            self.mapped[filename] = memoryview(mm if mm is not None else b"").cast(fmt)
+        return self.mapped[filename]
+
+    def close(self) -> None:
+        for view in self.mapped.values():
+            view.release()
+        self.mapped = {}
+        for f_in in self.files:
+            f_in.close()
+        self.files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class EtymologyStore(MappedDirectory):
+    """
+    Read-only view of a compiled store.
+    """
+    INDEXES = {"by_term": ("term", "lang"), "by_related": ("related_term", "related_lang")}
+
+    def __init__(self, directory: Path = STORE_PATH):
+        super().__init__(directory)
+        self.rows: int = self.meta["rows"]
+        self.columns: List[str] = self.meta["columns"]
+        self.vocabularies: Dict[str, List[str]] = self.meta["vocabularies"]
+
+    def value(self, row: int, column: str):
+        if column in INT_COLUMNS:
+            value = self.view(column + ".int32", "i")[row]
+            return None if value == NULL_INT else value
+        if column in self.vocabularies:
+            return self.vocabularies[column][self.view(column + ".int16", "h")[row]] or None
+        offsets = self.view(column + ".offsets", "q")
+        data = self.view(column + ".data", "B")
+        return bytes(data[offsets[row]:offsets[row + 1]]).decode("utf-8") or None
+
+    def key(self, row: int, columns: Sequence[str]) -> Tuple[str, ...]:
+        return tuple(self.value(row, column) or "" for column in columns)
+
+    def row(self, row: int) -> Row:
+        return tuple(self.value(row, column) for column in self.columns)
+
+    def search(self, index_name: str, target: Tuple[str, ...]) -> List[Row]:
+        """
+        Rows whose index key starts with `target`, found by binary search over the index permutation.
+        """
+        index = self.view(index_name + ".int32", "i")
+        columns = self.INDEXES[index_name][:len(target)]
+
+        def key(i: int) -> Tuple[str, ...]:
+            return self.key(index[i], columns)
+
+        lo, hi = 0, len(index)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = []
+        while lo < len(index) and key(lo) == target:
+            found.append(self.row(index[lo]))
+            lo += 1
+        return found
+
+    def by_term(self, term: str) -> List[Row]:
+        return self.search("by_term", (term,))
+
+    def by_lang_term(self, lang: str, term: str) -> List[Row]:
+        return self.search("by_term", (term, lang))
+
+    def by_related(self, related_term: str, related_lang: Optional[str] = None) -> List[Row]:
+        return self.search("by_related", (related_term,) if related_lang is None else (related_term, related_lang))
+
+
+def main_cli(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compile and query the memory-mapped etymology store.")
+    parser.add_argument("--store", type=Path, default=STORE_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    compile_parser = commands.add_parser("compile", help="Build the store from the CSV output.")
+    compile_parser.add_argument("--input", type=Path, default=ETYMOLOGY_PATH)
+    for name, help_text in (("lookup", "Rows of a term."), ("related", "Rows whose related term is the term.")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("term")
+        command.add_argument("--lang", default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level="INFO")
+    if args.command == "compile":
+        compile_store(args.input, args.store)
+        return 0
+    start = time.perf_counter()
+    with EtymologyStore(args.store) as store:
+        if args.command == "related":
+            rows = store.by_related(args.term, args.lang)
+        elif args.lang is None:
+            rows = store.by_term(args.term)
+        else:
+            rows = store.by_lang_term(args.lang, args.term)
+        writer = csv.writer(sys.stdout)
+        writer.writerow(Etymology.header())
+        writer.writerows(rows)
+    logging.info("{} rows in {:.1f} ms".format(len(rows), (time.perf_counter() - start) * 1000))
+    return 0 if rows else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
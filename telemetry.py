@@ -0,0 +1,94 @@
+import json
+import logging
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from time import monotonic
+from typing import Callable, Dict, Optional
+
+# Seconds between two samples written to the stats file
+TELEMETRY_INTERVAL = 10
+# Counters sampled from a run, reported with their rate since the previous sample
+RATE_METRICS = ("pages_read", "pages_dispatched", "rows_written", "input_bytes_read")
+
+
+class Telemetry:
+    """
+    Periodically samples the counters of a running extraction (through `sample`, which is called from a
+    background thread and must only read) and appends them, along with rates since the previous sample and
+    an ETA based on the input consumed so far, to a JSON-lines file. If `port` is given, the latest sample is
+    also served as JSON over HTTP on localhost.
+    """
+    def __init__(self, sample: Callable[[], Dict], path: Optional[Path] = None, port: Optional[int] = None,
+                 interval: float = TELEMETRY_INTERVAL):
+        self.sample = sample
+        self.path = path
+        self.interval = interval
+        self.start = monotonic()
+        self.previous: Optional[Dict] = None
+        self.latest: Dict = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="telemetry", daemon=True)
+        self.server = None
+        if port is not None:
+            self.server = ThreadingHTTPServer(("127.0.0.1", port), self.handler())
+            threading.Thread(target=self.server.serve_forever, name="telemetry-http", daemon=True).start()
+            logging.info("Serving run statistics on http://127.0.0.1:{}/".format(self.server.server_port))
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.record()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.record()
+
+    def record(self) -> Dict:
+        elapsed = monotonic() - self.start
+        metrics = self.sample()
+        snapshot = {"time": datetime.now().isoformat(timespec="seconds"), "elapsed_seconds": round(elapsed, 3)}
+        snapshot.update(metrics)
+        for name in RATE_METRICS:
+            if name in metrics:
+                previous = self.previous or {"elapsed_seconds": 0.0, name: 0}
+                seconds = elapsed - previous["elapsed_seconds"]
+                snapshot[name + "_per_second"] = round((metrics[name] - previous[name]) / seconds, 1) if seconds else 0
+        total, done = metrics.get("input_bytes_total"), metrics.get("input_bytes_read")
+        if total and done:
+            snapshot["input_fraction"] = round(done / total, 4)
+            snapshot["eta_seconds"] = round(elapsed * (total - done) / done)
+        busy = metrics.get("worker_busy_seconds")
+        if busy is not None and elapsed:
+            snapshot["worker_utilization"] = {worker: round(seconds / elapsed, 3) for worker, seconds in busy.items()}
+        self.previous = snapshot
+        self.latest = snapshot
+        if self.path is not None:
+            with open(self.path, "a") as f_out:
+                f_out.write(json.dumps(snapshot) + "\n")
+        return snapshot
+
+    def handler(self):
+        telemetry = self
+
+        class StatsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(telemetry.latest).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug(format, *args)
+
+        return StatsHandler
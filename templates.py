@@ -1,6 +1,8 @@
 import logging
-from multiprocessing import Manager
+from collections import Counter
+from contextlib import contextmanager
 from enum import Enum
+from time import perf_counter
 from typing import Callable, List
 
 from mwparserfromhell.nodes.template import Template
@@ -8,7 +10,11 @@ from mwparserfromhell.nodes.template import Template
 from elements import Etymology
 
 
-unparsed_templates = dict()
+# Per-process profiling counters, keyed by (metric, template or parser name). Workers hand them
+# back to the parent with each batch through `pop_template_stats`.
+template_stats = Counter()
+# Inclusive seconds of the nested calls made so far by each timed call in progress, innermost last
+nested_seconds: List[float] = []
 
 class RelType(Enum):
     Inherited = "inherited_from"
@@ -45,23 +51,65 @@ class RelType(Enum):
 
 
 def parse_template(template_name: str, term: str, lang: str, template: Template) -> List[Etymology]:
-    parser_func = get_template_parser(template_name.strip())
+    name = template_name.strip()
+    parser_func = get_template_parser(name)
+    template_stats["calls", name] += 1
     if not parser_func:
-        counter = unparsed_templates.get(template_name, 0)
-        unparsed_templates[template_name] = counter + 1
+        template_stats["unrecognized", name] += 1
         logging.debug(f"Unrecognized template name `{template_name}` (term: {term}, lang: {lang})")
         return []
     try:
-        result = parser_func(term, lang, template)
+        with timed(parser_func.__name__):
+            result = parser_func(term, lang, template)
     except Exception:
+        template_stats["errors", name] += 1
         logging.warning(f"Error while parsing:\nTerm: {term}\nLanguage: {lang}\n"
                       f"Wikicode: {template}\n", exc_info=True)
         return []
     return [result] if isinstance(result, Etymology) else result
 
 
+@contextmanager
+def timed(name: str):
+    """
+    Counts a call to `name` and the time spent in it, excluding nested timed calls (which count against their own
+    names), so that the seconds of all parsers add up to the time spent parsing templates.
+    """
+    nested_seconds.append(0.0)
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        seconds = perf_counter() - start
+        template_stats["parser_calls", name] += 1
+        template_stats["parser_seconds", name] += seconds - nested_seconds.pop()
+        if nested_seconds:
+            nested_seconds[-1] += seconds
+
+
+def coverage_stats(stats: Counter) -> Counter:
+    """
+    The counters of how often templates were seen, not recognized or raised, without the parser timings, which
+    only hold for the run that measured them.
+    """
+    return Counter({key: value for key, value in stats.items() if not key[0].startswith("parser_")})
+
+
+def pop_template_stats() -> Counter:
+    """
+    Returns the profiling counters gathered in this process since the last call, and resets them.
+    """
+    stats = template_stats.copy()
+    template_stats.clear()
+    return stats
+
+
+def ignored(term: str, lang: str, template: Template):
+    return []
+
+
 def get_template_parser(template_name: str) -> Callable[[str, str, Template], Etymology]:
-    default_func = lambda x, y, z: []
+    default_func = ignored
     parse_dict = {
         "inherited": inherited,
         "inh": inherited,
@@ -757,6 +805,7 @@ def derived_parsed(term: str, lang: str, template: Template):
     )
 
 
+@timed("unnest_template")
 def unnest_template(term: str, lang: str, template: Template, reltype: RelType):
     """
     Builds etymologies out of nested templates, assigning the immediate parent to a given child
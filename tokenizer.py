@@ -0,0 +1,274 @@
+import re
+from html.entities import entitydefs
+from typing import List, Optional, Tuple
+
+from mwparserfromhell.definitions import URI_SCHEMES
+from mwparserfromhell.nodes import Node
+from mwparserfromhell.nodes.extras import Parameter
+from mwparserfromhell.nodes.template import Template
+from mwparserfromhell.nodes.text import Text
+from mwparserfromhell.nodes.wikilink import Wikilink
+from mwparserfromhell.smart_list import SmartList
+from mwparserfromhell.wikicode import Wikicode
+
+# Markup the scanner has to decide on; anything between two tokens is plain text
+TOKEN = re.compile(r"<!--|\{\{+|\}\}|\[\[|\]\]|'{2,}|[\n<&|={}\[\]]")
+# Template names and link titles, up to the first character that ends them or that mwparserfromhell rejects in them
+TEMPLATE_NAME = re.compile(r"[^{}\[\]<>|]*")
+LINK_TITLE = re.compile(r"[^{}\[\]<>|\n]*")
+LINE_START_MARKUP = re.compile(r"\n[*#:;=-]")
+# Parameter keys and values without any markup, which make up most of them
+PLAIN_TEXT = re.compile(r"[^{}\[\]<>|=&'\n]*")
+ENTITY = re.compile(r"&(?:#[xX]([0-9a-fA-F]+)|#([0-9]+)|([a-zA-Z0-9]+));")
+REF_OPEN = re.compile(r"<ref(?:\s+\w+\s*=\s*(?:\"[^\"<>\n]*\"|'[^'<>\n]*'|[^\s\"'<>/=]+))*\s*(/?)>")
+REF_CLOSE = re.compile(r"</ref>")
+# List items and horizontal rules, after a newline
+LINE_MARKERS = re.compile(r"[*#:;]+|-{4,}")
+# Anything that could start a free or bracketed external link
+URI_SCHEME = re.compile(r"\b(?:" + "|".join(
+    re.escape(scheme) for scheme in sorted(URI_SCHEMES, key=len, reverse=True)) + r"):", re.IGNORECASE)
+# Nesting depth past which a section is left to mwparserfromhell (well below its own recursion limit)
+MAX_DEPTH = 20
+
+# What the text being scanned is part of, which decides the markup that ends it and the markup allowed in it
+TOP, KEY, VALUE, LINK_TEXT, STYLE, REF_BODY = range(6)
+
+
+class Unsupported(Exception):
+    """
+    Raised on markup the scanner leaves to mwparserfromhell.
+    """
+
+
+def scan_section(section: str) -> Optional[Wikicode]:
+    """
+    Tokenizes a sliced Etymology section (heading line first) into the top-level Text, Template and Wikilink
+    nodes that `clean_wikicode` and the template parsers work with, building the nodes directly instead of
+    running mwparserfromhell. The heading is dropped, as `clean_wikicode` would remove it anyway.
+
+    Comments, refs, HTML entities, bold/italics and list/rule markup are skipped at the top level, which splits
+    the text around them into separate Text nodes, just like the nodes `clean_wikicode` removes from
+    mwparserfromhell's output. Inside templates and links, they're kept as text.
+
+    Returns None when the section contains anything the scanner doesn't handle, in which case the caller
+    falls back to parsing the section with mwparserfromhell.
+    """
+    line_end = section.find("\n")
+    if line_end == -1:
+        return Wikicode(SmartList())
+    if URI_SCHEME.search(section, line_end):
+        return None
+    try:
+        nodes, _ = SectionScanner(section).scan(line_end, len(section), TOP, 0)
+    except Unsupported:
+        return None
+    return Wikicode(SmartList(nodes))
+
+
+def wikicode(nodes: List[Node]) -> Wikicode:
+    return Wikicode(SmartList(nodes))
+
+
+def build(node_type: type, **fields):
+    """
+    Creates a Template, Wikilink or Parameter without going through its setters, which run every value through
+    mwparserfromhell's `parse_anything` (costing more than the whole scan); `fields` are its attributes, the
+    Wikicode objects `parse_anything` would have kept as they are.
+    """
+    node = node_type.__new__(node_type)
+    node.__dict__.update(fields)
+    return node
+
+
+def valid_entity(entity: re.Match) -> bool:
+    hexadecimal, decimal, name = entity.groups()
+    if name is not None:
+        return name in entitydefs
+    return 1 <= (int(hexadecimal, 16) if hexadecimal is not None else int(decimal)) <= 0x10FFFF
+
+
+class SectionScanner:
+    """
+    Recursive-descent scanner for the subset of wikitext found in Etymology sections, producing the same nodes
+    as mwparserfromhell (as far as extraction is concerned) and raising `Unsupported` on anything else,
+    including every construct mwparserfromhell would give up on and emit as text.
+    """
+    def __init__(self, text: str):
+        self.text = text
+
+    def scan(self, pos: int, end: int, context: int, depth: int, ticks: str = "") -> Tuple[List[Node], int]:
+        """
+        Scans from `pos` until the markup ending `context` (a template parameter's `|`, `=` or `}}`, a link's
+        `]]`, the `ticks` closing bold/italics, or `end`), returning the nodes found along with the offset of
+        the closing `|`, `=` or `}}` or the offset past any other closing markup.
+        """
+        if depth > MAX_DEPTH:
+            raise Unsupported
+        text = self.text
+        top = context == TOP
+        nodes: List[Node] = []
+        # Start of the text not yet added to `nodes`
+        start = pos
+        template_end = -1
+        while True:
+            m = TOKEN.search(text, pos, end)
+            if m is None:
+                if context not in (TOP, REF_BODY):
+                    raise Unsupported
+                self.add_text(nodes, start, end)
+                return nodes, end
+            token, at, pos = m.group(0), m.start(), m.end()
+            if token == "<!--":
+                close = text.find("-->", pos, end)
+                if close == -1:
+                    raise Unsupported
+                pos = close + 3
+                if top:
+                    self.add_text(nodes, start, at)
+                    start = pos
+            elif token.startswith("{{"):
+                # mwparserfromhell fails a key that has `{` right after a nested template and then an `=`
+                if len(token) > 2 or (context == KEY and at == template_end):
+                    raise Unsupported
+                template, pos = self.template(pos, end, depth)
+                self.add_text(nodes, start, at)
+                nodes.append(template)
+                start = template_end = pos
+            elif token == "[[":
+                if context == LINK_TEXT:
+                    raise Unsupported
+                link, pos = self.wikilink(pos, end, depth)
+                self.add_text(nodes, start, at)
+                nodes.append(link)
+                start = pos
+            elif token[0] == "'":
+                if len(token) > 3:
+                    raise Unsupported
+                if context == STYLE:
+                    if token != ticks:
+                        raise Unsupported
+                    self.add_text(nodes, start, at)
+                    return nodes, pos
+                inner, pos = self.scan(pos, end, STYLE, depth + 1, token)
+                # Links are replaced by their text, which mustn't bring up templates from within bold/italics
+                if context == LINK_TEXT and any(isinstance(node, Template) for node in inner):
+                    raise Unsupported
+                if top:
+                    self.add_text(nodes, start, at)
+                    start = pos
+                else:
+                    self.add_text(nodes, start, at + len(token))
+                    nodes.extend(inner)
+                    start = pos - len(token)
+            elif token in ("|", "}}"):
+                if context in (KEY, VALUE):
+                    self.add_text(nodes, start, at)
+                    return nodes, at
+                if not top and not (context == LINK_TEXT and token == "|"):
+                    raise Unsupported
+            elif token == "]]":
+                if context == LINK_TEXT:
+                    self.add_text(nodes, start, at)
+                    return nodes, pos
+                if not top:
+                    raise Unsupported
+            elif token == "=":
+                # A heading, unless within a template parameter's value
+                if text[at - 1] == "\n" and context != VALUE:
+                    raise Unsupported
+                if context == KEY:
+                    self.add_text(nodes, start, at)
+                    return nodes, at
+            elif token == "\n":
+                marker = LINE_MARKERS.match(text, pos, end)
+                if marker is not None:
+                    if ";" in marker.group(0):
+                        raise Unsupported
+                    if top:
+                        self.add_text(nodes, start, pos)
+                        start = pos = marker.end()
+            elif token == "<":
+                ref = REF_OPEN.match(text, at, end) if top else None
+                if ref is not None:
+                    pos = ref.end()
+                    if not ref.group(1):
+                        close = REF_CLOSE.search(text, pos, end)
+                        if close is None:
+                            raise Unsupported
+                        self.scan(pos, close.start(), REF_BODY, depth + 1)
+                        pos = close.end()
+                    self.add_text(nodes, start, at)
+                    start = pos
+                elif text[pos:pos + 1].isalpha() or text.startswith(("/", "!"), pos, end):
+                    raise Unsupported
+            elif token == "&":
+                entity = ENTITY.match(text, at, end)
+                if entity is not None and valid_entity(entity):
+                    pos = entity.end()
+                    if top:
+                        self.add_text(nodes, start, at)
+                        start = pos
+            elif token == "{":
+                if not top or text.startswith("|", pos, end):
+                    raise Unsupported
+            elif token == "[":
+                if not top or text.startswith("//", pos, end):
+                    raise Unsupported
+            elif not top:
+                # Single `}` and `]`
+                raise Unsupported
+
+    def template(self, pos: int, end: int, depth: int) -> Tuple[Template, int]:
+        """
+        Scans a template from just past its `{{`, returning it and the offset past its `}}`. Positional
+        parameters are numbered like mwparserfromhell does, counting only the unnamed ones.
+        """
+        text = self.text
+        name_end = TEMPLATE_NAME.match(text, pos, end).end()
+        name = text[pos:name_end]
+        if not name.strip() or "\n" in name.strip() or "''" in name or LINE_START_MARKUP.search(name):
+            raise Unsupported
+        params = []
+        position = 1
+        pos = name_end
+        while text.startswith("|", pos, end):
+            key, pos = self.plain(pos + 1, end, ("|", "}}", "=")) or self.scan(pos + 1, end, KEY, depth + 1)
+            if text.startswith("=", pos, end):
+                value, pos = self.plain(pos + 1, end, ("|", "}}")) or self.scan(pos + 1, end, VALUE, depth + 1)
+                params.append(build(Parameter, _name=wikicode(key), _value=wikicode(value), _showkey=True))
+            else:
+                params.append(build(Parameter, _name=wikicode([Text(str(position))]), _value=wikicode(key),
+                                   _showkey=False))
+                position += 1
+        if not text.startswith("}}", pos, end):
+            raise Unsupported
+        return build(Template, _name=wikicode([Text(name)]), _params=params), pos + 2
+
+    def plain(self, pos: int, end: int, closing: Tuple[str, ...]) -> Optional[Tuple[List[Node], int]]:
+        """
+        Shortcut for `scan` on a parameter key or value that is plain text up to its `closing` markup.
+        """
+        plain_end = PLAIN_TEXT.match(self.text, pos, end).end()
+        if not self.text.startswith(closing, plain_end, end):
+            return None
+        return ([Text(self.text[pos:plain_end])] if plain_end > pos else []), plain_end
+
+    def wikilink(self, pos: int, end: int, depth: int) -> Tuple[Wikilink, int]:
+        """
+        Scans a link from just past its `[[`, returning it and the offset past its `]]`.
+        """
+        text = self.text
+        title_end = LINK_TITLE.match(text, pos, end).end()
+        title = wikicode([Text(text[pos:title_end])] if title_end > pos else [])
+        if "''" in text[pos:title_end] or text.startswith("//", pos, title_end):
+            raise Unsupported
+        if text.startswith("]]", title_end, end):
+            return build(Wikilink, _title=title, _text=None), title_end + 2
+        if not text.startswith("|", title_end, end):
+            raise Unsupported
+        inner, pos = self.scan(title_end + 1, end, LINK_TEXT, depth + 1)
+        return build(Wikilink, _title=title, _text=wikicode(inner)), pos
+
+    def add_text(self, nodes: List[Node], start: int, end: int) -> None:
+        if end > start:
+            nodes.append(Text(self.text[start:end]))
@@ -0,0 +1,257 @@
+import csv
+import gzip
+import logging
+import os
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Set
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from elements import Etymology, lang_dict
+from templates import RelType
+
+# Rows buffered in memory before a Parquet row group is written out
+ROW_GROUP_SIZE = 256 * 1024
+# Rows inserted per SQLite transaction
+TRANSACTION_SIZE = 512 * 1024
+
+
+class CsvWriter:
+    """
+    Writes rows to a gzipped CSV file, header first. With `resume_offset`, the file is truncated to that size
+    (as returned by `checkpoint`) and appended to instead.
+    """
+    def __init__(self, path: Path, resume_offset: Optional[int] = None):
+        self.path = path
+        if resume_offset is None:
+            self.open("wt")
+            self.writer.writerow(Etymology.header())
+        else:
+            os.truncate(path, resume_offset)
+            self.open("at")
+
+    def open(self, mode: str) -> None:
+        self.f_out = gzip.open(self.path, mode)
+        self.writer = csv.writer(self.f_out)
+
+    def checkpoint(self) -> int:
+        """
+        Ends the current gzip member, so that everything written so far is on disk as a complete gzip file,
+        and returns its size. Later rows go into a new member appended to it.
+        """
+        self.f_out.close()
+        self.open("at")
+        return self.path.stat().st_size
+
+    def writerows(self, rows: Iterable[Sequence]) -> None:
+        self.writer.writerows(rows)
+
+    def close(self) -> None:
+        self.f_out.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ParquetWriter:
+    """
+    Streams rows into a Parquet file, writing a row group every `row_group_size` rows. Language and
+    relation type columns are dictionary-encoded; positions are nullable integers.
+    """
+    DICTIONARY_COLUMNS = ("lang", "reltype", "related_lang")
+    INT_COLUMNS = ("position", "parent_position")
+
+    def __init__(self, path: Path, row_group_size: int = ROW_GROUP_SIZE):
+        if pa is None:
+            raise ImportError("Parquet output requires pyarrow (`pip install pyarrow`)")
+        self.row_group_size = row_group_size
+        self.columns = Etymology.header()
+        self.schema = pa.schema([pa.field(name, self.column_type(name)) for name in self.columns])
+        self.writer = pq.ParquetWriter(str(path), self.schema, use_dictionary=list(self.DICTIONARY_COLUMNS))
+        self.buffer: List[Sequence] = []
+
+    def column_type(self, name: str) -> "pa.DataType":
+        if name in self.DICTIONARY_COLUMNS:
+            return pa.dictionary(pa.int32(), pa.string())
+        if name in self.INT_COLUMNS:
+            return pa.int32()
+        return pa.string()
+
+    def writerows(self, rows: Iterable[Sequence]) -> None:
+        self.buffer.extend(rows)
+        while len(self.buffer) >= self.row_group_size:
+            self.flush(self.buffer[:self.row_group_size])
+            del self.buffer[:self.row_group_size]
+
+    def flush(self, rows: List[Sequence]) -> None:
+        arrays = []
+        for i, field in enumerate(self.schema):
+            values = pa.array([row[i] for row in rows], type=field.type.value_type
+                              if pa.types.is_dictionary(field.type) else field.type)
+            arrays.append(values.dictionary_encode() if pa.types.is_dictionary(field.type) else values)
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self) -> None:
+        if self.buffer:
+            self.flush(self.buffer)
+            self.buffer = []
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SqliteWriter:
+    """
+    Bulk-loads rows into an `etymology` table of a SQLite database, with journaling and syncing turned
+    off, and only builds the indexes (and, with `fts`, a full-text index on `term`) once everything is
+    loaded. The database is written to `<path>.new` and renamed into place when complete.
+    """
+    INDEXES = {
+        "etymology_term_id": ("term_id",),
+        "etymology_related_term_id": ("related_term_id",),
+        "etymology_lang_term": ("lang", "term"),
+        "etymology_group_tag": ("group_tag",),
+        "etymology_parent_tag": ("parent_tag",),
+    }
+
+    def __init__(self, path: Path, fts: bool = False, transaction_size: int = TRANSACTION_SIZE):
+        self.path = path
+        self.new_path = path.with_name(path.name + ".new")
+        if self.new_path.exists():
+            self.new_path.unlink()
+        self.fts = fts
+        self.transaction_size = transaction_size
+        self.pending = 0
+        self.conn = sqlite3.connect(self.new_path, isolation_level=None)
+        for pragma in ("journal_mode = OFF", "synchronous = OFF", "temp_store = MEMORY", "cache_size = -262144",
+                       "locking_mode = EXCLUSIVE"):
+            self.conn.execute("PRAGMA " + pragma)
+        columns = ", ".join("{} {}".format(name, "INTEGER" if name in ParquetWriter.INT_COLUMNS else "TEXT")
+                            for name in Etymology.header())
+        self.conn.execute("CREATE TABLE etymology ({})".format(columns))
+        self.insert = "INSERT INTO etymology VALUES ({})".format(", ".join("?" * len(Etymology.header())))
+        self.conn.execute("BEGIN")
+
+    def writerows(self, rows: Iterable[Sequence]) -> None:
+        rows = list(rows)
+        self.conn.executemany(self.insert, rows)
+        self.pending += len(rows)
+        if self.pending >= self.transaction_size:
+            self.conn.execute("COMMIT")
+            self.conn.execute("BEGIN")
+            self.pending = 0
+
+    def close(self) -> None:
+        self.conn.execute("COMMIT")
+        for name, columns in self.INDEXES.items():
+            logging.info("Building index {}".format(name))
+            self.conn.execute("CREATE INDEX {} ON etymology ({})".format(name, ", ".join(columns)))
+        if self.fts:
+            logging.info("Building full-text index on term")
+            self.conn.execute("CREATE VIRTUAL TABLE etymology_fts USING fts5(term, content='etymology', "
+                              "content_rowid='rowid')")
+            self.conn.execute("INSERT INTO etymology_fts(etymology_fts) VALUES ('rebuild')")
+        self.conn.execute("ANALYZE")
+        self.conn.close()
+        os.replace(self.new_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.conn.close()
+
+
+class NormalizedWriter:
+    """
+    Writes the rows as four gzipped CSV tables in `directory`, joined on integer surrogate keys:
+
+    - terms.csv.gz: key, term_id (the `make_uuid` id of the flat output), lang_key, term
+    - languages.csv.gz: key, name, codes (space-separated codes from `wiktionary_codes.csv`, if any)
+    - reltypes.csv.gz: key, reltype
+    - edges.csv.gz: term_key, reltype_key, related_term_key, position, group_key, parent_group_key,
+      parent_position
+
+    Group tags only link rows of the same page, so they're renumbered per `writerows` call.
+    """
+    def __init__(self, directory: Path):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.directory = directory
+        self.languages: Dict[str, int] = {}
+        self.language_codes: Dict[str, List[str]] = {}
+        for code, name in lang_dict().items():
+            self.language_key(name)
+            self.language_codes[name].append(code)
+        self.reltypes = {reltype.value: key for key, reltype in enumerate(RelType)}
+        self.seen_terms: Set[int] = set()
+        self.next_group_key = 0
+        self.f_terms = gzip.open(directory.joinpath("terms.csv.gz"), "wt")
+        self.terms = csv.writer(self.f_terms)
+        self.terms.writerow(("key", "term_id", "lang_key", "term"))
+        self.f_edges = gzip.open(directory.joinpath("edges.csv.gz"), "wt")
+        self.edges = csv.writer(self.f_edges)
+        self.edges.writerow(("term_key", "reltype_key", "related_term_key", "position", "group_key",
+                             "parent_group_key", "parent_position"))
+
+    def language_key(self, name: str) -> int:
+        if name not in self.languages:
+            self.languages[name] = len(self.languages)
+            self.language_codes[name] = []
+        return self.languages[name]
+
+    def term_key(self, term_id: Optional[str], lang: Optional[str], term: Optional[str]) -> Optional[int]:
+        if not term_id:
+            return None
+        key = Etymology.term_key(term_id)
+        if key not in self.seen_terms:
+            self.seen_terms.add(key)
+            self.terms.writerow((key, term_id, self.language_key(lang), term))
+        return key
+
+    def writerows(self, rows: Iterable[Sequence]) -> None:
+        groups: Dict[str, int] = {}
+        for (term_id, lang, term, reltype, related_term_id, related_lang, related_term, position,
+             group_tag, parent_tag, parent_position) in rows:
+            group_key = parent_group_key = None
+            if group_tag:
+                group_key = groups.setdefault(group_tag, self.next_group_key + len(groups))
+            if parent_tag:
+                parent_group_key = groups.setdefault(parent_tag, self.next_group_key + len(groups))
+            self.edges.writerow((self.term_key(term_id, lang, term), self.reltypes[reltype],
+                                 self.term_key(related_term_id, related_lang, related_term), position,
+                                 group_key, parent_group_key, parent_position))
+        self.next_group_key += len(groups)
+
+    def close(self) -> None:
+        self.f_terms.close()
+        self.f_edges.close()
+        with gzip.open(self.directory.joinpath("languages.csv.gz"), "wt") as f_out:
+            writer = csv.writer(f_out)
+            writer.writerow(("key", "name", "codes"))
+            writer.writerows((key, name, " ".join(self.language_codes[name]))
+                             for name, key in self.languages.items())
+        with gzip.open(self.directory.joinpath("reltypes.csv.gz"), "wt") as f_out:
+            writer = csv.writer(f_out)
+            writer.writerow(("key", "reltype"))
+            writer.writerows((key, reltype) for reltype, key in self.reltypes.items())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()